@@ -1,13 +1,15 @@
-import shutil, asyncio
-from pathlib import Path
+import sys, asyncio
 from playwright.async_api import async_playwright
+from Scale4_screenshot import USERDATA_DIR, RESET_MODES, profile_manager
 
-USERDATA_DIR = Path("./userdata")
+# Usage: python "Reset Chromium.py" [cache|auth|all]   (default: all)
+mode = sys.argv[1] if len(sys.argv) > 1 else "all"
+if mode not in RESET_MODES:
+    sys.exit(f"Unknown reset mode {mode!r}; choose one of: {', '.join(RESET_MODES)}")
 
-# Delete profile
-if USERDATA_DIR.exists():
-    shutil.rmtree(USERDATA_DIR)
-    print("Chromium reset successfully")
+# Delete the cache, the login state or the whole profile
+if profile_manager.reset(USERDATA_DIR, mode):
+    print(f"Chromium reset successfully ({mode})")
 
 # Launch fresh browser
 async def main():
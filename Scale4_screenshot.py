@@ -2,21 +2,111 @@
 # Selected SS
 
 
+import argparse
 import asyncio
+import contextlib
+import fnmatch
 import json
 import logging
 import getpass
+import hashlib
+import io
+import multiprocessing
+import os
+import random
 import re
+import shutil
+import socket
+import sqlite3
+import sys
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from queue import Empty
+from urllib.parse import urlparse
+import numpy as np
 from playwright.async_api import async_playwright, Page
-from PIL import Image, ImageChops, ImageOps
+from PIL import Image, ImageOps
+
+try:
+    import fcntl
+except ImportError:  # Windows: clones use hardlinks and copies only
+    fcntl = None
+
+try:
+    import imagehash
+except ImportError:  # perceptual hashes are optional
+    imagehash = None
+
+try:
+    from skimage.metrics import structural_similarity
+except ImportError:  # falls back to the NumPy SSIM below
+    structural_similarity = None
 
 JSON_FILE = Path("screenshots.json")
 SCREENSHOT_DIR = Path("screenshots")
 TEMP_SCREENSHOT_DIR = Path("screenshots_tmp")
-USERDATA_DIR = Path("./userdata")
+USERDATA_DIR = Path("./userdata")  # Interactive profile; also the logged-in "golden" profile that others are cloned from
+PROFILES_DIR = Path("./profiles")  # Cloned per-worker Chromium profiles
 LOG_FILE = Path("screenshot_log.txt")
+RUNS_DIR = Path("runs")  # Append-only journal per screenshot run, used to resume interrupted runs
+TIMINGS_DIR = RUNS_DIR / "timings"  # Per-run JSONL timing spans (navigate, replay, settle, ...)
+SLOWEST_ENTRIES = 5  # Entries listed in the end-of-run timing report
+APP_URL = "https://single.mcns.io"  # Application start page, used as default URL and for session checks
+LOGIN_URL_MARKER = "saml_login"  # Navigations landing on a URL containing this hit the SSO login
+SESSION_STATE_FILE = Path("session_state.json")  # Cookies/localStorage of a logged-in session, shared with fresh contexts
+SESSION_EXPIRY_MARGIN_S = 300  # Stored cookies expiring within this many seconds count as expired
+DIGEST_INDEX_FILE = Path("screenshots_digests.json")  # Pixel/perceptual hashes of the baselines in SCREENSHOT_DIR
+PREVIEW_DIR = Path("screenshots_previews")  # Cached review previews and full-resolution patches
 HIGH_RESOLUTION_SCALE = 4  # High-res factor
+BORDER_WIDTH = 5  # Black border added around every capture
+IMAGE_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # Processes for PIL encode/diff work
+DIFF_TILE_SIZE = 256  # Edge length of the tiles compared by the diff engine
+COMPARE_MODE = "exact"  # "exact": any pixel counts; "tolerant": channel threshold + anti-aliasing; "ssim": structural similarity
+CHANNEL_THRESHOLD = 24  # tolerant: per-channel differences up to this are rendering noise (hides a uniform tint as small)
+IGNORE_ANTIALIASING = True  # tolerant: ignore pixels explained by a one-pixel shift of an edge
+SSIM_THRESHOLD = 0.98  # ssim: tiles whose worst 7x7 window scores below this are changed
+PREVIEW_WIDTH = 1280  # Width of the review previews (captures are HIGH_RESOLUTION_SCALE times wider)
+PATCH_MARGIN = 32  # Pixels of context around each changed region in the full-resolution patches
+MAX_PATCHES = 12  # Largest changed regions cut as patches per screenshot
+CAPTURE_WORKERS = 3  # Pages working through the manifest in parallel
+CAPTURE_PROCESSES = 1  # Worker processes with their own Chromium each; 1 captures in this process only
+CAPTURE_PROCESS_CHECK_S = 5  # How often the coordinator checks for capture processes that died without reporting
+JOBS_DB = Path("capture_jobs.sqlite")  # Job table shared by the coordinator and capture nodes
+JOB_LEASE_S = 120  # A claimed job goes back to the queue when its worker stops heartbeating this long
+JOB_HEARTBEAT_S = 20  # How often a worker extends the lease of the job it is capturing
+JOB_MAX_ATTEMPTS = 3  # Claims per job before it is given up as failed
+JOB_POLL_S = 5  # Coordinator progress / idle worker polling interval
+RETRY_ATTEMPTS = 3  # Captures per entry: the first try plus requeues at the end of the run
+RETRY_BASE_DELAY_S = 2  # Backoff before a retry: up to base * 2**(retry - 1) seconds, full jitter
+RETRY_MAX_DELAY_S = 30
+PHASE_BUDGETS_S = {"navigate": 45, "replay": 30, "settle": 20, "capture": 30}  # Per-entry limits; replay also gets the recorded waits
+MAX_CONCURRENT_CAPTURES = 2  # Navigations/captures allowed to hit the app server at once
+COMPARE_QUEUE_SIZE = 4  # Finished captures waiting for comparison before capture pages block
+ROUTE_SOFT_RESET = True  # Reuse a loaded route between entries with an in-app reset instead of a reload
+STATE_MUTATING_ACTIONS = {"keyboard", "click", "mousedown", "mouseup"}  # Entries with these need a reload afterwards
+PREFIX_POINT_BUCKET_PX = 16  # Pointer actions within the same cell count as the same step when sharing action prefixes
+BATCH_VIEWPORT = "1920x1080"  # Fixed viewport for headless batch runs
+EXIT_OK = 0
+EXIT_FAILURES = 1  # Batch mode: at least one entry could not be captured
+EXIT_CHANGES_PENDING = 2  # Batch mode: changes were found that the rules did not accept
+SETTLE_TIMEOUT_MS = 10000  # Ceiling for the render-settle detector
+SETTLE_QUIET_MS = 300  # DOM must be free of mutations this long to count as stable
+HOVER_DWELL_MS = 250  # Resting the cursor this long on one spot counts as a deliberate hover
+OPTIMIZE_RECORDED_ACTIONS = True  # Simplify mouse paths of newly recorded entries
+SPINNER_SELECTOR = ('[class*="spinner"], [class*="loading"], [class*="loader"], '
+                    '[aria-busy="true"], [role="progressbar"]')  # Loading indicators the recorder watches
+NETWORK_QUIET_MS = 100  # Replay: no requests in flight for this long counts as network idle
+REPLAY_BACKEND = "playwright"  # "cdp" sends each run of input between waits as one batch; "playwright" sends one call per action
+WAIT_HISTORY_FILE = Path("wait_history.json")  # Replay waits learned per entry from earlier runs
+ADAPTIVE_WAITS = True  # Shorten plain recorded waits once runs show the next target is ready sooner
+WAIT_SAFETY_FACTOR = 1.5  # Learned wait = slowest observed readiness times this
+WAIT_SHRINK_RATE = 0.7  # A learned wait drops at most to this fraction of its previous value per run
+WAIT_HISTORY_RUNS = 5  # Readiness observations kept per wait
+WAIT_FALLBACK_RUNS = 3  # Runs that use the recorded waits again after a shortened run produced a diff
+MIN_WAIT_MS = 50  # Floor for learned waits
+WAIT_POLL_MS = 50  # How often readiness is checked during a wait
 
 
 username = getpass.getuser()
@@ -75,6 +165,29 @@ async def get_current_url(context):
     return context.pages[-1], context.pages[-1].url
 
 
+def wait_conditions(cond):
+    """Turn the recorder's "what happened during this gap" info into replay wait conditions."""
+    if not cond:
+        return {}
+    until = {}
+    if cond.get("requests") and not cond.get("inflight"):
+        until["network_idle"] = True
+    if cond.get("added"):
+        until["selector"] = cond["added"]
+    if cond.get("spinnerGone"):
+        until["spinner_gone"] = True
+    return until
+
+
+def merge_waits(first, second):
+    """One wait covering two consecutive ones; their conditions are combined."""
+    merged = {"type": "wait", "ms": first["ms"] + second["ms"]}
+    until = {**first.get("until", {}), **second.get("until", {})}
+    if until:
+        merged["until"] = until
+    return merged
+
+
 def convert_events_to_actions(events):
     """Convert raw JS events into structured Playwright actions."""
     if not events:
@@ -84,7 +197,11 @@ def convert_events_to_actions(events):
     for ev in events:
         delta = ev["t"] - last_time
         if delta > 40:
-            actions.append({"type": "wait", "ms": delta})
+            wait = {"type": "wait", "ms": delta}
+            until = wait_conditions(ev.get("cond"))
+            if until:
+                wait["until"] = until
+            actions.append(wait)
         if ev["type"] == "click":
             actions.append({"type": "click", "x": ev["x"], "y": ev["y"]})
         elif ev["type"] == "scrollTo":
@@ -104,6 +221,73 @@ def convert_events_to_actions(events):
     return actions
 
 
+def optimize_actions(actions):
+    """Collapse mousemove runs to the points that matter without shortening the recording.
+
+    Within each run of mousemoves/waits between two other actions we keep:
+    waits at the start of the run (the app reacting to the previous action),
+    moves the cursor rested on for HOVER_DWELL_MS or more together with that pause,
+    moves followed by a wait with conditions ("until": the app was still loading),
+    and the final position before the next action (or the end, i.e. the hover in the shot).
+    The pauses of dropped moves are merged into one wait before the next kept move, so the
+    time between two kept actions stays what it was (the app may have been loading).
+    """
+    optimized = []
+    run = []
+
+    def push(act):
+        if act["type"] == "wait" and optimized and optimized[-1]["type"] == "wait":
+            optimized[-1] = merge_waits(optimized[-1], act)
+        else:
+            optimized.append(act)
+
+    def flush_run():
+        i = 0
+        while i < len(run) and run[i]["type"] == "wait":
+            push(run[i])
+            i += 1
+        moves = []  # (move, pause after it)
+        for act in run[i:]:
+            if act["type"] == "mousemove":
+                moves.append([act, {"type": "wait", "ms": 0}])
+            else:
+                moves[-1][1] = merge_waits(moves[-1][1], act)
+        dropped = 0
+        for n, (move, pause) in enumerate(moves):
+            last = n == len(moves) - 1
+            keep_pause = pause["ms"] >= HOVER_DWELL_MS or "until" in pause
+            if not (last or keep_pause):
+                dropped += pause["ms"]
+                continue
+            if dropped:
+                push({"type": "wait", "ms": dropped})
+                dropped = 0
+            push(move)
+            if pause["ms"] or "until" in pause:
+                push(pause)
+        run.clear()
+
+    for act in actions:
+        if act["type"] in ("mousemove", "wait"):
+            run.append(act)
+            continue
+        flush_run()
+        push(act)
+    flush_run()
+    return optimized
+
+
+def optimize_manifest(data):
+    """Apply optimize_actions to every entry in place. Returns (actions before, actions after)."""
+    before = after = 0
+    for entry in data:
+        actions = entry.get("actions", [])
+        before += len(actions)
+        entry["actions"] = optimize_actions(actions)
+        after += len(entry["actions"])
+    return before, after
+
+
 def parse_indices(input_str, total_entries):
     indices = set()
     for part in input_str.split(','):
@@ -123,90 +307,420 @@ def parse_indices(input_str, total_entries):
     return [i for i in sorted(indices) if 1 <= i <= total_entries]
 
 
-async def replay_actions(page, actions):
-    for act in actions:
-        typ = act["type"]
+async def replay_actions(page, actions, backend=None, waits=None):
+    """Replay recorded actions on page with the configured backend.
+
+    waits (see WaitLearner.plan) replaces the plain recorded waits with learned ones.
+    """
+    network_tracker(page)
+    if (backend or REPLAY_BACKEND) == "cdp":
+        await replay_actions_cdp(page, actions, waits)
+        return
+    for i, act in enumerate(actions):
+        if waits is not None and is_plain_wait(act):
+            await waits.wait(page, i, act, actions[i + 1] if i + 1 < len(actions) else None)
+        else:
+            await replay_action(page, act)
+
+
+def is_plain_wait(act):
+    """A recorded pause without conditions; only these are left to the wait learner."""
+    return act["type"] == "wait" and not act.get("until")
+
+
+class NetworkTracker:
+    """Counts a page's requests in flight, for network_idle wait conditions."""
+
+    def __init__(self, page):
+        self.inflight = 0
+        self.last_change = time.monotonic()
+        page.on("request", self._started)
+        page.on("requestfinished", self._ended)
+        page.on("requestfailed", self._ended)
+
+    def _started(self, _request):
+        self.inflight += 1
+        self.last_change = time.monotonic()
+
+    def _ended(self, _request):
+        self.inflight = max(0, self.inflight - 1)  # requests started before tracking began
+        self.last_change = time.monotonic()
+
+    def idle(self, since):
+        """No request in flight and none started or finished for NETWORK_QUIET_MS, counted from since.
+
+        since is when the wait began: the quiet must follow the action being waited on, or a
+        request the action fires a few milliseconds later would be missed.
+        """
+        quiet_from = max(self.last_change, since)
+        return self.inflight == 0 and (time.monotonic() - quiet_from) * 1000 >= NETWORK_QUIET_MS
+
+
+_network_trackers = weakref.WeakKeyDictionary()
+
+
+def network_tracker(page):
+    if page not in _network_trackers:
+        _network_trackers[page] = NetworkTracker(page)
+    return _network_trackers[page]
+
+
+WAIT_CONDITIONS_JS = r"""
+({ selector, spinners }) => {
+  if (selector) {
+    let el = null;
+    try { el = document.querySelector(selector); } catch (e) { return true; }  // unusable selector: don't block
+    if (!el) return false;
+  }
+  if (spinners) {
+    if (Array.from(document.querySelectorAll(spinners)).some(el => el.offsetParent !== null)) return false;
+  }
+  return true;
+}
+"""
+
+
+async def wait_for_conditions(page, until, max_ms):
+    """Wait until the recorded conditions hold; the recorded duration max_ms is only an upper bound.
+
+    Returns the milliseconds actually waited.
+    """
+    tracker = network_tracker(page)
+    start = time.monotonic()
+    deadline = start + max_ms / 1000
+    args = {"selector": until.get("selector"), "spinners": SPINNER_SELECTOR if until.get("spinner_gone") else None}
+    while True:
+        ready = not until.get("network_idle") or tracker.idle(start)
+        if ready and (args["selector"] or args["spinners"]):
+            try:
+                ready = await page.evaluate(WAIT_CONDITIONS_JS, args)
+            except Exception:
+                ready = False  # navigating; keep waiting
+        if ready or time.monotonic() >= deadline:
+            return round((time.monotonic() - start) * 1000)
+        await asyncio.sleep(0.05)
+
+
+TARGET_READY_JS = r"""
+({ x, y, spinners }) => {
+  if (document.readyState !== 'complete') return false;
+  if (Array.from(document.querySelectorAll(spinners)).some(el => el.offsetParent !== null)) return false;
+  if (x === null) return true;
+  const el = document.elementFromPoint(x, y);
+  return !!el && el !== document.documentElement;
+}
+"""
 
-        if typ == "wait":
-            await asyncio.sleep(act["ms"] / 1000)
 
-        elif typ == "click":
-            await page.mouse.click(act["x"], act["y"])
-
-        elif typ == "mousedown":
-            await page.mouse.move(act["x"], act["y"])
-            await page.mouse.down()
-
-        elif typ == "mousemove":
-            await page.mouse.move(act["x"], act["y"])
-
-        elif typ == "mouseup":
-            await page.mouse.move(act["x"], act["y"])
-            await page.mouse.up()
-
-        elif typ == "scrollTo":
-            await page.evaluate(f"window.scrollTo({act['x']}, {act['y']})")
-
-        # ✅ Wheel event replay fix — now also handles missing selectors
-        elif typ == "wheel":
-            selector = act.get("selector", "")
-            dx = act.get("deltaX", 0)
-            dy = act.get("deltaY", 0)
-
-            if selector:
-                # Try dispatching a wheel event to the original element
-                script = f"""
-                (function(){{
-                  try {{
-                    const el = document.querySelector({json.dumps(selector)});
-                    if (el) {{
-                      const ev = new WheelEvent('wheel', {{
-                        deltaX: {dx},
-                        deltaY: {dy},
-                        bubbles: true,
-                        cancelable: true
-                      }});
-                      el.dispatchEvent(ev);
-                      el.scrollBy({dx}, {dy});
-                      return true;
-                    }}
-                  }} catch (e) {{
-                    console.warn('Wheel replay failed for selector', e);
-                  }}
-                  return false;
-                }})();
-                """
-                ok = await page.evaluate(script)
-                if not ok:
-                    try:
-                        await page.mouse.wheel(dx, dy)
-                    except Exception:
-                        await page.evaluate(f"window.scrollBy({dx}, {dy})")
+async def target_ready(page, act):
+    """Whether the page is ready for act: loaded, no spinner, and an element under its pointer."""
+    pointer = act is not None and act["type"] in ("click", "mousedown", "mousemove", "mouseup")
+    args = {"x": act["x"] if pointer else None, "y": act["y"] if pointer else None, "spinners": SPINNER_SELECTOR}
+    try:
+        return await page.evaluate(TARGET_READY_JS, args)
+    except Exception:
+        return False  # navigating
+
+
+class EntryWaits:
+    """One run's view of an entry's learned waits; notes when each wait's next target was ready."""
+
+    def __init__(self, learned, offset=0):
+        self.learned = learned
+        self.offset = offset  # actions already replayed by an earlier step (plan_schedule skip)
+        self.observed = {}
+        self.shortened = False
+
+    async def wait(self, page, position, act, next_act):
+        """Wait the learned time, or longer (up to the recorded time) until next_act's target is ready."""
+        key = str(position + self.offset)
+        recorded = act["ms"]
+        learned = self.learned.get(key)
+        delay = learned["ms"] if learned and learned["recorded"] == recorded else recorded
+        self.shortened = self.shortened or delay < recorded
+        start = time.monotonic()
+        ready_at = None
+        while True:
+            elapsed = (time.monotonic() - start) * 1000
+            if elapsed >= recorded:
+                break
+            if await target_ready(page, next_act):
+                if ready_at is None:
+                    ready_at = elapsed
+                if elapsed >= delay:
+                    break
             else:
-                # No selector available → fallback to page-level scroll
-                try:
-                    await page.mouse.wheel(dx, dy)
-                except Exception:
-                    await page.evaluate(f"window.scrollBy({dx}, {dy})")
+                ready_at = None  # the target went away again; only a later readiness counts
+            await asyncio.sleep(min(WAIT_POLL_MS, recorded - elapsed) / 1000)
+        self.observed[key] = [recorded, round(recorded if ready_at is None else ready_at)]
+
+
+class WaitLearner:
+    """Learns per-entry replay waits from earlier runs, persisted in WAIT_HISTORY_FILE.
+
+    A plain wait shrinks towards WAIT_SAFETY_FACTOR times the slowest readiness seen in
+    the last WAIT_HISTORY_RUNS runs, by at most WAIT_SHRINK_RATE per run and only after a
+    run whose capture matched the baseline. If a run with shortened waits produces a diff,
+    the entry's learned waits are dropped and the recorded ones are used for
+    WAIT_FALLBACK_RUNS runs.
+    """
+
+    def __init__(self, path=WAIT_HISTORY_FILE):
+        self.path = Path(path)
+        self.history = {}
+        self.runs = {}
+
+    def load(self):
+        self.runs = {}
+        self.history = {}
+        if self.path.exists():
+            try:
+                self.history = json.loads(self.path.read_text())
+            except ValueError:
+                logging.warning(f"Ignoring unreadable wait history {self.path}")
+
+    def save(self):
+        if self.history or self.path.exists():
+            self.path.write_text(json.dumps(self.history, indent=4))
+
+    def forget(self, names):
+        """Drop what was learned for entries whose actions were rewritten."""
+        self.load()
+        for name in names:
+            self.history.pop(name, None)
+        self.save()
+
+    def plan(self, name, offset=0):
+        """Waits to replay entry name with, or None when adaptive waits are off."""
+        if not ADAPTIVE_WAITS:
+            return None
+        record = self.history.get(name, {})
+        waits = EntryWaits({} if record.get("fallback_runs") else record.get("waits", {}), offset)
+        self.runs[name] = waits
+        return waits
+
+    def adopt(self, name, observed, shortened):
+        """Take over what a capture worker process observed for name, ahead of record_outcome()."""
+        waits = EntryWaits({})
+        waits.observed, waits.shortened = observed, shortened
+        self.runs[name] = waits
+
+    def record_outcome(self, name, status):
+        """Learn from the compare status ("new", "unchanged", "changed") of this run's capture."""
+        waits = self.runs.pop(name, None)
+        if waits is None:
+            return
+        record = self.history.setdefault(name, {"waits": {}})
+        if record.get("fallback_runs"):
+            record["fallback_runs"] -= 1
+            return
+        if status == "changed" and waits.shortened:
+            record["waits"] = {}
+            record["fallback_runs"] = WAIT_FALLBACK_RUNS
+            logging.warning(f"{name} changed after a run with shortened waits; using the recorded waits again.")
+            return
+        if status != "unchanged":
+            return  # nothing to validate the observations against
+        for key, (recorded, needed) in waits.observed.items():
+            learned = record["waits"].get(key)
+            if learned is None or learned["recorded"] != recorded:
+                learned = {"recorded": recorded, "ms": recorded, "needed": []}  # new or re-recorded wait
+            learned["needed"] = (learned["needed"] + [needed])[-WAIT_HISTORY_RUNS:]
+            target = max(MIN_WAIT_MS, max(learned["needed"]) * WAIT_SAFETY_FACTOR)
+            learned["ms"] = round(min(recorded, max(target, learned["ms"] * WAIT_SHRINK_RATE)))
+            record["waits"][key] = learned
+
+
+wait_learner = WaitLearner()
+
+
+async def replay_action(page, act):
+    """Replay one action through the Playwright API."""
+    typ = act["type"]
+
+    if typ == "wait":
+        if act.get("until"):
+            await wait_for_conditions(page, act["until"], act["ms"])
+        else:
+            await asyncio.sleep(act["ms"] / 1000)
 
-        # ✅ Handle scrollable element replay (still needed for div.scrollable)
-        elif typ == "scrollElement":
-            selector = act.get("selector")
-            if selector:
-                script = f"""
+    elif typ == "click":
+        await page.mouse.click(act["x"], act["y"])
+
+    elif typ == "mousedown":
+        await page.mouse.move(act["x"], act["y"])
+        await page.mouse.down()
+
+    elif typ == "mousemove":
+        await page.mouse.move(act["x"], act["y"])
+
+    elif typ == "mouseup":
+        await page.mouse.move(act["x"], act["y"])
+        await page.mouse.up()
+
+    elif typ == "scrollTo":
+        await page.evaluate(f"window.scrollTo({act['x']}, {act['y']})")
+
+    # ✅ Wheel event replay fix — now also handles missing selectors
+    elif typ == "wheel":
+        selector = act.get("selector", "")
+        dx = act.get("deltaX", 0)
+        dy = act.get("deltaY", 0)
+
+        if selector:
+            # Try dispatching a wheel event to the original element
+            script = f"""
+            (function(){{
+              try {{
                 const el = document.querySelector({json.dumps(selector)});
                 if (el) {{
-                  el.scrollTo({act['x']}, {act['y']});
+                  const ev = new WheelEvent('wheel', {{
+                    deltaX: {dx},
+                    deltaY: {dy},
+                    bubbles: true,
+                    cancelable: true
+                  }});
+                  el.dispatchEvent(ev);
+                  el.scrollBy({dx}, {dy});
+                  return true;
                 }}
-                """
-                await page.evaluate(script)
-
-        elif typ == "keyboard":
+              }} catch (e) {{
+                console.warn('Wheel replay failed for selector', e);
+              }}
+              return false;
+            }})();
+            """
+            ok = await page.evaluate(script)
+            if not ok:
+                try:
+                    await page.mouse.wheel(dx, dy)
+                except Exception:
+                    await page.evaluate(f"window.scrollBy({dx}, {dy})")
+        else:
+            # No selector available → fallback to page-level scroll
             try:
-                await page.keyboard.press(act["key"])
+                await page.mouse.wheel(dx, dy)
             except Exception:
-                await page.keyboard.insert_text(act["key"])
+                await page.evaluate(f"window.scrollBy({dx}, {dy})")
+
+    # ✅ Handle scrollable element replay (still needed for div.scrollable)
+    elif typ == "scrollElement":
+        selector = act.get("selector")
+        if selector:
+            script = f"""
+            const el = document.querySelector({json.dumps(selector)});
+            if (el) {{
+              el.scrollTo({act['x']}, {act['y']});
+            }}
+            """
+            await page.evaluate(script)
+
+    elif typ == "keyboard":
+        try:
+            await page.keyboard.press(act["key"])
+        except Exception:
+            await page.keyboard.insert_text(act["key"])
+
+
+# Named keys Playwright's US layout sends with a virtual key code (and text for Enter)
+CDP_KEYS = {
+    "Enter": (13, "Enter", "\r"),
+    "Tab": (9, "Tab", ""),
+    "Backspace": (8, "Backspace", ""),
+    "Escape": (27, "Escape", ""),
+    "Delete": (46, "Delete", ""),
+    "Home": (36, "Home", ""),
+    "End": (35, "End", ""),
+    "PageUp": (33, "PageUp", ""),
+    "PageDown": (34, "PageDown", ""),
+    "ArrowLeft": (37, "ArrowLeft", ""),
+    "ArrowUp": (38, "ArrowUp", ""),
+    "ArrowRight": (39, "ArrowRight", ""),
+    "ArrowDown": (40, "ArrowDown", ""),
+}
+
+
+def compile_cdp_action(act, pointer):
+    """Translate one action into CDP (method, params) messages.
+
+    pointer tracks the cursor position and pressed buttons across the batch.
+    Returns None for actions that need the Playwright path (selector wheels, unknown keys).
+    """
+    typ = act["type"]
+
+    def mouse(kind, **extra):
+        params = {"type": kind, "x": pointer["x"], "y": pointer["y"],
+                  "button": "left" if pointer["buttons"] else "none", "buttons": pointer["buttons"]}
+        params.update(extra)
+        return ("Input.dispatchMouseEvent", params)
+
+    if typ in ("mousemove", "mousedown", "mouseup", "click"):
+        pointer["x"], pointer["y"] = act["x"], act["y"]
+        messages = [mouse("mouseMoved")]
+        if typ in ("mousedown", "click"):
+            pointer["buttons"] = 1
+            messages.append(mouse("mousePressed", button="left", clickCount=1))
+        if typ in ("mouseup", "click"):
+            pointer["buttons"] = 0
+            messages.append(mouse("mouseReleased", button="left", clickCount=1))
+        return messages
+
+    if typ == "wheel":
+        if act.get("selector"):
+            return None
+        return [mouse("mouseWheel", deltaX=act.get("deltaX", 0), deltaY=act.get("deltaY", 0))]
+
+    if typ == "scrollTo":
+        return [("Runtime.evaluate", {"expression": f"window.scrollTo({act['x']}, {act['y']})"})]
+
+    if typ == "keyboard":
+        key = act["key"]
+        if key in CDP_KEYS:
+            code, name, text = CDP_KEYS[key]
+            down = {"type": "keyDown" if text else "rawKeyDown", "key": key, "code": name,
+                    "windowsVirtualKeyCode": code, "text": text}
+        elif len(key) == 1:
+            code = ord(key.upper()) if key.isalnum() else 0
+            name = f"Key{key.upper()}" if key.isalpha() else (f"Digit{key}" if key.isdigit() else "")
+            down = {"type": "keyDown", "key": key, "code": name, "windowsVirtualKeyCode": code, "text": key}
+        else:
+            return None
+        up = {"type": "keyUp", "key": key, "code": down["code"], "windowsVirtualKeyCode": down["windowsVirtualKeyCode"]}
+        return [("Input.dispatchKeyEvent", down), ("Input.dispatchKeyEvent", up)]
+
+    return None
+
+
+async def replay_actions_cdp(page, actions, waits=None):
+    """Replay actions by sending each run of non-wait actions as one pipelined CDP batch.
+
+    The messages of a batch are all written before any reply is awaited, so the batch
+    costs one round trip; CDP handles them in order. Waits are honoured between batches
+    and actions CDP cannot express fall back to replay_action.
+    """
+    session = await page.context.new_cdp_session(page)
+    pointer = {"x": 0, "y": 0, "buttons": 0}
+    batch = []
+
+    async def flush():
+        if batch:
+            await asyncio.gather(*(session.send(method, params) for method, params in batch))
+            batch.clear()
 
+    try:
+        for i, act in enumerate(actions):
+            messages = None if act["type"] == "wait" else compile_cdp_action(act, pointer)
+            if messages is not None:
+                batch.extend(messages)
+                continue
+            await flush()
+            if waits is not None and is_plain_wait(act):
+                await waits.wait(page, i, act, actions[i + 1] if i + 1 < len(actions) else None)
+            else:
+                await replay_action(page, act)
+        await flush()
+    finally:
+        await session.detach()
 
 
 
@@ -290,8 +804,41 @@ async () => {
   let lastMove = { x: 0, y: 0, t: 0 };
   let lastScroll = { x: window.scrollX, y: window.scrollY, t: start };
 
+  // What the page was busy with since the previous event, so replay can wait for it
+  // instead of sleeping for the recorded gap.
+  const SPINNERS = __SPINNER_SELECTOR__;
+  let inflight = 0, finished = 0, added = '', sawSpinner = false;
+  const track = p => { inflight++; const done = () => { inflight = Math.max(0, inflight - 1); finished++; }; p.then(done, done); return p; };
+  const origFetch = window.fetch;
+  window.fetch = function() { return track(origFetch.apply(this, arguments)); };
+  const origSend = XMLHttpRequest.prototype.send;
+  XMLHttpRequest.prototype.send = function() {
+    inflight++;
+    this.addEventListener('loadend', () => { inflight = Math.max(0, inflight - 1); finished++; }, { once: true });
+    return origSend.apply(this, arguments);
+  };
+  const spinnerVisible = () => Array.from(document.querySelectorAll(SPINNERS)).some(el => el.offsetParent !== null);
+  const spinnerPoll = setInterval(() => { if (spinnerVisible()) sawSpinner = true; }, 100);
+  const domObserver = new MutationObserver(records => {
+    for (const r of records) {
+      for (const node of r.addedNodes) {
+        if (node.nodeType !== Node.ELEMENT_NODE || ['SCRIPT', 'STYLE', 'LINK'].includes(node.tagName)) continue;
+        if (node.closest && node.closest('#overlay-root')) continue;
+        added = node.id ? '#' + CSS.escape(node.id) : uniqueSelector(node);
+      }
+    }
+  });
+  domObserver.observe(document.body, { childList: true, subtree: true });
+
   function emit(type, payload) {
     payload.t = Date.now() - start;
+    const spinnerNow = spinnerVisible();
+    payload.cond = {
+      requests: finished, inflight,
+      added: added && document.querySelector(added) ? added : '',
+      spinnerGone: sawSpinner && !spinnerNow
+    };
+    finished = 0; added = ''; sawSpinner = spinnerNow;
     send({ type, ...payload });
   }
 
@@ -367,13 +914,17 @@ async () => {
     window.removeEventListener('click', onClick, true);
     window.removeEventListener('keydown', onKey, true);
     window.removeEventListener('wheel', onWheel, true);
+    window.fetch = origFetch;
+    XMLHttpRequest.prototype.send = origSend;
+    clearInterval(spinnerPoll);
+    domObserver.disconnect();
     window._inlineRecorderActive = false;
   };
 
   console.log('[Recorder] Started with full mouse + wheel + scroll tracking');
   return 'recording_started';
 }
-"""
+""".replace("__SPINNER_SELECTOR__", json.dumps(SPINNER_SELECTOR))
 
 
 
@@ -385,7 +936,587 @@ async () => {
 STOP_RECORDING_JS = "() => (window.__stopInlineRecorder ? window.__stopInlineRecorder() : []);"
 
 
-async def take_screenshot(page: Page, path, clip):
+SETTLE_PAGE_JS = r"""
+async ({ x, y, quietMs, timeoutMs, spinners }) => {
+  const start = performance.now();
+  const deadline = start + timeoutMs;
+  const sleep = ms => new Promise(r => setTimeout(r, ms));
+  // rAF is paused in background tabs, so never wait on it alone
+  const nextFrame = () => Promise.race([new Promise(r => requestAnimationFrame(() => r())), sleep(50)]);
+
+  let lastMutation = performance.now();
+  const observer = new MutationObserver(() => { lastMutation = performance.now(); });
+  observer.observe(document, { subtree: true, childList: true, attributes: true, characterData: true });
+
+  const state = {};
+  try {
+    if (document.fonts && document.fonts.status !== 'loaded') {
+      await Promise.race([document.fonts.ready, sleep(timeoutMs)]);
+    }
+    while (performance.now() < deadline) {
+      const root = document.scrollingElement || document.documentElement;
+      const targetX = Math.min(x, Math.max(0, root.scrollWidth - window.innerWidth));
+      const targetY = Math.min(y, Math.max(0, root.scrollHeight - window.innerHeight));
+      state.scrolled = Math.abs(window.scrollX - targetX) <= 1 && Math.abs(window.scrollY - targetY) <= 1;
+      if (!state.scrolled) window.scrollTo(x, y);
+
+      state.fonts = !document.fonts || document.fonts.status === 'loaded';
+      // Finite animations block until they end. Infinite ones never end: they block only while
+      // they run on a visible loading indicator, like the spinner check below.
+      const visible = el => !!el && el.offsetParent !== null;
+      const running = document.getAnimations ? document.getAnimations().filter(a => a.playState === 'running') : [];
+      const infinite = running.filter(a =>
+        !isFinite(a.effect && a.effect.getComputedTiming ? a.effect.getComputedTiming().endTime : Infinity));
+      state.animations = running.length - infinite.length;
+      state.loadingAnimations = infinite.filter(a => {
+        const target = a.effect && a.effect.target;
+        return target instanceof Element && visible(target) && !!target.closest(spinners);
+      }).length;
+      state.spinners = Array.from(document.querySelectorAll(spinners)).filter(visible).length;
+      const pending = Array.from(document.images).filter(img => !img.complete);
+      state.images = pending.length;
+      if (pending.length) {
+        await Promise.race([Promise.all(pending.map(img => img.decode().catch(() => null))), sleep(100)]);
+      }
+      state.quiet = performance.now() - lastMutation >= quietMs;
+
+      if (state.scrolled && state.fonts && !state.animations && !state.loadingAnimations && !state.spinners &&
+          !state.images && state.quiet) {
+        return { settled: true, ms: Math.round(performance.now() - start), state };
+      }
+      await nextFrame();
+    }
+    return { settled: false, ms: Math.round(performance.now() - start), state };
+  } finally {
+    observer.disconnect();
+  }
+}
+"""
+
+
+async def wait_for_settle(page: Page, x=0, y=0, timeout_ms=SETTLE_TIMEOUT_MS):
+    """Scroll to (x, y) and return as soon as the page is visually stable, or after timeout_ms.
+
+    Stable means no visible SPINNER_SELECTOR element and a quiet network (see NetworkTracker)
+    as well as the DOM checks of SETTLE_PAGE_JS. A request that starts while the DOM settles
+    sends the check round again. Returns a dict with "settled", "ms" (time spent waiting)
+    and the last observed "state".
+    """
+    tracker = network_tracker(page)
+    start = time.monotonic()
+    deadline = start + timeout_ms / 1000
+    try:
+        while True:
+            while not tracker.idle(start) and time.monotonic() < deadline:
+                await asyncio.sleep(WAIT_POLL_MS / 1000)
+            remaining_ms = max(0, round((deadline - time.monotonic()) * 1000))
+            settle = await page.evaluate(
+                SETTLE_PAGE_JS,
+                {"x": x, "y": y, "quietMs": SETTLE_QUIET_MS, "timeoutMs": remaining_ms, "spinners": SPINNER_SELECTOR},
+            )
+            settle["state"]["network"] = tracker.idle(start)
+            if settle["state"]["network"] or not settle["settled"] or time.monotonic() >= deadline:
+                settle["settled"] = settle["settled"] and settle["state"]["network"]
+                settle["ms"] = round((time.monotonic() - start) * 1000)
+                return settle
+    except Exception as e:
+        # Navigation while settling destroys the execution context
+        logging.warning(f"Settle detection interrupted: {e}")
+        return {"settled": False, "ms": None, "state": {"error": str(e)}}
+
+
+def pixel_digest(img):
+    """Content hash of the decoded RGB pixels, plus a perceptual hash when imagehash is installed."""
+    rgb = img.convert("RGB")
+    sha = hashlib.sha256(f"{rgb.width}x{rgb.height}:".encode())
+    sha.update(rgb.tobytes())
+    digest = {"pixels": sha.hexdigest(), "size": [rgb.width, rgb.height]}
+    if imagehash is not None:
+        digest["phash"] = str(imagehash.phash(rgb))
+    return digest
+
+
+def image_digest(path):
+    """pixel_digest of an image file (runs in the image stage)."""
+    with Image.open(path) as img:
+        return pixel_digest(img)
+
+
+def save_bordered(png_bytes, path):
+    """Add the border and write the capture to path (runs in the image stage).
+
+    Returns the pixel digest of the written image, computed from the bordered image still in
+    memory, with the seconds spent on "border" (decode + border) and "encode" (PNG encode,
+    write, digest) under "timings".
+    """
+    start = time.perf_counter()
+    with Image.open(io.BytesIO(png_bytes)) as img:
+        bordered = ImageOps.expand(img, border=BORDER_WIDTH, fill="black")
+    bordered_at = time.perf_counter()
+    buffer = io.BytesIO()
+    bordered.save(buffer, format="PNG")
+    Path(path).write_bytes(buffer.getvalue())
+    digest = pixel_digest(bordered)  # same pixels as the written PNG, without decoding it again
+    digest["timings"] = {"border": bordered_at - start, "encode": time.perf_counter() - bordered_at}
+    return digest
+
+
+def load_digest_index():
+    if DIGEST_INDEX_FILE.exists():
+        try:
+            return json.loads(DIGEST_INDEX_FILE.read_text())
+        except ValueError:
+            logging.warning(f"Ignoring unreadable digest index {DIGEST_INDEX_FILE}")
+    return {}
+
+
+def save_digest_index(index):
+    DIGEST_INDEX_FILE.write_text(json.dumps(index, indent=4))
+
+
+def file_stamp(path):
+    """Size and mtime of a file, used to tell whether a stored digest still matches it."""
+    stat = Path(path).stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+async def baseline_digest(index, main_file):
+    """Digest of a baseline from the index, recomputed (and stored) only when the file changed."""
+    entry = index.get(main_file.name)
+    stamp = file_stamp(main_file)
+    if entry is None or entry.get("stamp") != stamp:
+        entry = await image_stage.run(image_digest, main_file)
+        entry["stamp"] = stamp
+        index[main_file.name] = entry
+    return entry
+
+
+def phash_distance(a, b):
+    """Hamming distance between two perceptual hashes, or None when either is missing."""
+    if imagehash is None or not a.get("phash") or not b.get("phash"):
+        return None
+    return imagehash.hex_to_hash(a["phash"]) - imagehash.hex_to_hash(b["phash"])
+
+
+def load_rgb_array(path):
+    """Decode an image into an RGB uint8 array without an extra conversion when it is already RGB."""
+    with Image.open(path) as img:
+        img.load()
+        return np.asarray(img if img.mode == "RGB" else img.convert("RGB"))
+
+
+def iter_tiles(height, width, tile=DIFF_TILE_SIZE):
+    for y in range(0, height, tile):
+        for x in range(0, width, tile):
+            yield x, y, min(tile, width - x), min(tile, height - y)
+
+
+def diff_tiles(old, new, tile=DIFF_TILE_SIZE):
+    """Compare two RGB arrays tile by tile and return the changed tiles as (x, y, width, height).
+
+    The comparison temporaries are tile-sized; both decoded images are still held in full.
+    "Did anything change?" is answered earlier and cheaper by the pixel digests.
+    Arrays of different sizes count as one fully changed rectangle.
+    """
+    if old.shape != new.shape:
+        return [(0, 0, max(old.shape[1], new.shape[1]), max(old.shape[0], new.shape[0]))]
+    changed = []
+    for x, y, w, h in iter_tiles(old.shape[0], old.shape[1], tile):
+        if not np.array_equal(old[y:y + h, x:x + w], new[y:y + h, x:x + w]):
+            changed.append((x, y, w, h))
+    return changed
+
+
+def compare_options():
+    """Current comparison settings, passed explicitly so image stage workers use the same ones."""
+    return {
+        "mode": COMPARE_MODE,
+        "channel_threshold": CHANNEL_THRESHOLD,
+        "antialiasing": IGNORE_ANTIALIASING,
+        "ssim_threshold": SSIM_THRESHOLD,
+    }
+
+
+def _with_margin(arr, x, y, w, h):
+    """The tile at (x, y, w, h) plus a one-pixel margin, edge-padded at the image border."""
+    height, width = arr.shape[:2]
+    y0, y1 = max(0, y - 1), min(height, y + h + 1)
+    x0, x1 = max(0, x - 1), min(width, x + w + 1)
+    pad = ((y0 - (y - 1), (y + h + 1) - y1), (x0 - (x - 1), (x + w + 1) - x1), (0, 0))
+    return np.pad(arr[y0:y1, x0:x1], pad, mode="edge")
+
+
+def _local_range(win, h, w):
+    """Per-channel min and max over the 3x3 neighbourhood of every inner pixel of a margin window."""
+    shifts = [win[dy:dy + h, dx:dx + w] for dy in range(3) for dx in range(3)]
+    return np.minimum.reduce(shifts), np.maximum.reduce(shifts)
+
+
+def significant_pixels(old, new, x, y, w, h, threshold, antialiasing):
+    """Boolean mask of the tile's pixels that really changed.
+
+    A pixel counts when any channel moved by more than threshold. With antialiasing,
+    a pixel on an edge (high contrast in its 3x3 neighbourhood) whose new value lies within
+    the range of its old neighbours, and vice versa, is treated as the edge moving by a
+    sub-pixel amount (anti-aliasing, font hinting) and ignored.
+    """
+    a = old[y:y + h, x:x + w].astype(np.int16)
+    b = new[y:y + h, x:x + w].astype(np.int16)
+    mask = (np.abs(a - b) > threshold).any(axis=2)
+    if not antialiasing or not mask.any():
+        return mask
+    old_lo, old_hi = _local_range(_with_margin(old, x, y, w, h).astype(np.int16), h, w)
+    new_lo, new_hi = _local_range(_with_margin(new, x, y, w, h).astype(np.int16), h, w)
+    on_edge = ((old_hi - old_lo) > threshold).any(axis=2) & ((new_hi - new_lo) > threshold).any(axis=2)
+    new_fits = ((b >= old_lo - threshold) & (b <= old_hi + threshold)).all(axis=2)
+    old_fits = ((a >= new_lo - threshold) & (a <= new_hi + threshold)).all(axis=2)
+    return mask & ~(on_edge & new_fits & old_fits)
+
+
+def _box_mean(img, k=7):
+    """Mean over a k x k window for every pixel (integral image, edge-padded)."""
+    padded = np.pad(img, k // 2, mode="edge")
+    summed = np.pad(padded.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    return (summed[k:, k:] - summed[:-k, k:] - summed[k:, :-k] + summed[:-k, :-k]) / (k * k)
+
+
+def tile_ssim(old_tile, new_tile):
+    """Lowest local SSIM of two RGB tiles on their luma channel.
+
+    The minimum of the 7x7 SSIM map is used rather than its mean, so a small change
+    (a digit, an icon) is not averaged away by the unchanged rest of the tile.
+    """
+    weights = np.array([0.299, 0.587, 0.114])
+    a = old_tile.astype(np.float64) @ weights
+    b = new_tile.astype(np.float64) @ weights
+    if structural_similarity is not None and min(a.shape) >= 7:
+        _, ssim = structural_similarity(a, b, data_range=255, full=True)
+        return float(ssim.min())
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mu_a, mu_b = _box_mean(a), _box_mean(b)
+    var_a = _box_mean(a * a) - mu_a ** 2
+    var_b = _box_mean(b * b) - mu_b ** 2
+    cov = _box_mean(a * b) - mu_a * mu_b
+    ssim = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim.min())
+
+
+def changed_regions(tiles, tile=DIFF_TILE_SIZE):
+    """Group touching changed tiles (8-connected) into bounding rectangles, largest first."""
+    cells = {(x // tile, y // tile): (x, y, w, h) for x, y, w, h in tiles}
+    seen = set()
+    regions = []
+    for start in cells:
+        if start in seen:
+            continue
+        seen.add(start)
+        stack = [start]
+        x0 = y0 = float("inf")
+        x1 = y1 = 0
+        while stack:
+            cx, cy = stack.pop()
+            x, y, w, h = cells[(cx, cy)]
+            x0, y0, x1, y1 = min(x0, x), min(y0, y), max(x1, x + w), max(y1, y + h)
+            for nx in (cx - 1, cx, cx + 1):
+                for ny in (cy - 1, cy, cy + 1):
+                    if (nx, ny) in cells and (nx, ny) not in seen:
+                        seen.add((nx, ny))
+                        stack.append((nx, ny))
+        regions.append((x0, y0, x1 - x0, y1 - y0))
+    return sorted(regions, key=lambda r: r[2] * r[3], reverse=True)
+
+
+def _save_preview(arr, path):
+    """Downscale an RGB array to PREVIEW_WIDTH and save it, unless the cached file exists."""
+    if path.exists():
+        return
+    img = Image.fromarray(arr)
+    if img.width > PREVIEW_WIDTH:
+        img = img.resize((PREVIEW_WIDTH, max(1, round(img.height * PREVIEW_WIDTH / img.width))), Image.LANCZOS)
+    img.save(path)
+
+
+def diff_canvas(old, new, tiles):
+    """Absolute difference of the changed tiles, drawn at preview resolution.
+
+    Each tile's difference is computed at full resolution and scaled into a canvas at most
+    PREVIEW_WIDTH wide, so no full-size difference image is ever allocated.
+    """
+    height, width = new.shape[:2]
+    scale = min(1.0, PREVIEW_WIDTH / width)
+    canvas = Image.new("RGB", (max(1, int(width * scale)), max(1, int(height * scale))))
+    for x, y, w, h in tiles:
+        delta = np.abs(old[y:y + h, x:x + w].astype(np.int16) - new[y:y + h, x:x + w].astype(np.int16))
+        x0, y0 = int(x * scale), int(y * scale)
+        size = (max(1, int((x + w) * scale) - x0), max(1, int((y + h) * scale) - y0))
+        canvas.paste(Image.fromarray(delta.astype(np.uint8)).resize(size, Image.BOX), (x0, y0))
+    return np.asarray(canvas)
+
+
+def write_review_assets(old, new, canvas, tiles, keys):
+    """Write previews and full-resolution old/new/diff patches of changed regions to PREVIEW_DIR.
+
+    keys holds the pixel digests of the baseline ("old") and capture ("new"); files are
+    named after them, so an unchanged baseline keeps reusing its cached preview.
+    """
+    PREVIEW_DIR.mkdir(exist_ok=True)
+    old_key, new_key = keys["old"][:16], keys["new"][:16]
+    pair_key = f"{old_key}-{new_key}"
+    previews = {
+        "old": PREVIEW_DIR / f"{old_key}.png",
+        "new": PREVIEW_DIR / f"{new_key}.png",
+        "diff": PREVIEW_DIR / f"diff-{pair_key}.png",
+    }
+    _save_preview(old, previews["old"])
+    _save_preview(new, previews["new"])
+    _save_preview(canvas, previews["diff"])
+
+    height, width = new.shape[:2]
+    patches = []
+    for n, (x, y, w, h) in enumerate(changed_regions(tiles)[:MAX_PATCHES]):
+        x0, y0 = max(0, x - PATCH_MARGIN), max(0, y - PATCH_MARGIN)
+        x1, y1 = min(width, x + w + PATCH_MARGIN), min(height, y + h + PATCH_MARGIN)
+        patch = {"x": x0, "y": y0, "width": x1 - x0, "height": y1 - y0}
+        for side in ("old", "new", "diff"):
+            path = PREVIEW_DIR / f"patch-{pair_key}-{n}-{side}.png"
+            if not path.exists():
+                if side == "diff":
+                    pixels = np.abs(old[y0:y1, x0:x1].astype(np.int16) - new[y0:y1, x0:x1].astype(np.int16))
+                    pixels = pixels.astype(np.uint8)
+                else:
+                    pixels = (old if side == "old" else new)[y0:y1, x0:x1]
+                Image.fromarray(pixels).save(path)
+            patch[side] = str(path)
+        patches.append(patch)
+    return {
+        "previews": {k: str(v) for k, v in previews.items()},
+        "patches": patches,
+        "full_size": [width, height],
+    }
+
+
+def diff_images(old_path, new_path, diff_path, options=None, keys=None):
+    """Compare two captures with the tiled engine (runs in the image stage).
+
+    options come from compare_options(). Only tiles with an exact difference are examined
+    by the tolerant/SSIM modes. Returns {"changed", "tiles", "changed_pixels", "score", "mode"}:
+    score is 0 for identical images and grows with the visual change (fraction of changed
+    pixels for exact/tolerant, 1 - lowest local SSIM for ssim). When something changed, the
+    difference of the changed tiles (see diff_canvas) is written to diff_path and, when keys
+    (pixel digests of both images) are given, review previews and patches are added as "assets".
+    """
+    options = options or compare_options()
+    mode = options["mode"]
+    old = load_rgb_array(old_path)
+    new = load_rgb_array(new_path)
+    tiles = diff_tiles(old, new)
+    result = {"changed": False, "tiles": [], "changed_pixels": 0, "score": 0.0, "mode": mode}
+    if not tiles:
+        return result
+    if old.shape != new.shape:
+        result.update(changed=True, tiles=tiles, score=1.0,
+                      changed_pixels=max(old.shape[0] * old.shape[1], new.shape[0] * new.shape[1]))
+        Image.fromarray(new).save(diff_path)
+        if keys:
+            result["assets"] = write_review_assets(old, new, new, [], keys)
+        return result
+
+    total = old.shape[0] * old.shape[1]
+    lowest_ssim = 1.0
+    for x, y, w, h in tiles:
+        if mode == "ssim":
+            ssim = tile_ssim(old[y:y + h, x:x + w], new[y:y + h, x:x + w])
+            lowest_ssim = min(lowest_ssim, ssim)
+            if ssim >= options["ssim_threshold"]:
+                continue
+            mask = significant_pixels(old, new, x, y, w, h, 0, False)
+        elif mode == "tolerant":
+            mask = significant_pixels(old, new, x, y, w, h, options["channel_threshold"], options["antialiasing"])
+            if not mask.any():
+                continue
+        else:
+            mask = significant_pixels(old, new, x, y, w, h, 0, False)
+        result["tiles"].append((x, y, w, h))
+        result["changed_pixels"] += int(np.count_nonzero(mask))
+
+    result["changed"] = bool(result["tiles"])
+    result["score"] = 1.0 - lowest_ssim if mode == "ssim" else result["changed_pixels"] / total
+    if not result["changed"]:
+        return result
+    canvas = diff_canvas(old, new, result["tiles"])
+    Image.fromarray(canvas).save(diff_path)
+    if keys:
+        result["assets"] = write_review_assets(old, new, canvas, result["tiles"], keys)
+    return result
+
+
+def _timed_call(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class ImageStage:
+    """Runs PIL work in a process pool so Playwright and the other pages keep going meanwhile."""
+
+    def __init__(self, workers=IMAGE_WORKERS):
+        self.workers = workers
+        self.pending = 0
+        self.max_pending = 0
+        self.stats = {}  # task name -> {"count", "busy", "wait", "max"}
+        self._executor = None
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in a worker process (a thread when workers is 0) and await its result."""
+        if self._executor is None and self.workers:
+            # spawn: forking a process that drives Playwright is not safe
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        start = time.perf_counter()
+        try:
+            result, busy = await loop.run_in_executor(self._executor, _timed_call, fn, *args)  # None: default threads
+        finally:
+            self.pending -= 1
+        elapsed = time.perf_counter() - start
+        stat = self.stats.setdefault(fn.__name__, {"count": 0, "busy": 0.0, "wait": 0.0, "max": 0.0})
+        stat["count"] += 1
+        stat["busy"] += busy
+        stat["wait"] += elapsed - busy
+        stat["max"] = max(stat["max"], busy)
+        logging.info(f"[IMAGE] {fn.__name__} took {busy * 1000:.0f} ms (+{(elapsed - busy) * 1000:.0f} ms queued, depth {self.pending})")
+        return result
+
+    def report(self):
+        print(f"[INFO] Image stage: {self.workers or 'thread'} processes, max queue depth {self.max_pending}")
+        for name, stat in self.stats.items():
+            print(f"  {name}: {stat['count']} tasks, avg {stat['busy'] / stat['count'] * 1000:.0f} ms, "
+                  f"max {stat['max'] * 1000:.0f} ms, avg queued {stat['wait'] / stat['count'] * 1000:.0f} ms")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+image_stage = ImageStage()
+
+
+class RunTimings:
+    """Timing spans of a run's entries, appended to TIMINGS_DIR/<run_id>.jsonl, and the run report.
+
+    Phases: navigate, login wait, replay, settle, capture, border, encode, diff and review wait
+    (the last one for the whole run, entry None). Outside a run, spans are only kept in memory,
+    which is how capture worker processes collect them before handing them back with take().
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.path = None
+
+    def start(self, run_id):
+        TIMINGS_DIR.mkdir(parents=True, exist_ok=True)
+        self.path = TIMINGS_DIR / f"{run_id}.jsonl"
+        self.spans = []
+
+    def record(self, entry, phase, seconds, min_ms=0):
+        if seconds * 1000 < min_ms:
+            return
+        self.add([{"entry": entry, "phase": phase, "ms": round(seconds * 1000, 1), "time": round(time.time(), 3)}])
+
+    def add(self, spans):
+        self.spans.extend(spans)
+        if self.path is not None and spans:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(span) + "\n" for span in spans)
+
+    @contextlib.contextmanager
+    def span(self, entry, phase, min_ms=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(entry, phase, time.perf_counter() - start, min_ms)
+
+    def take(self):
+        spans, self.spans = self.spans, []
+        return spans
+
+    def summary(self, entries, duration):
+        """p50/p95/total per phase, the slowest entries and the throughput."""
+        phases = {}
+        per_entry = {}
+        for span in self.spans:
+            phases.setdefault(span["phase"], []).append(span["ms"])
+            if span["entry"] is not None:
+                per_entry.setdefault(span["entry"], {}).setdefault(span["phase"], 0)
+                per_entry[span["entry"]][span["phase"]] += span["ms"]
+        slowest = sorted(per_entry.items(), key=lambda item: sum(item[1].values()), reverse=True)[:SLOWEST_ENTRIES]
+        return {
+            "phases": {phase: {"count": len(values), "p50_ms": round(float(np.percentile(values, 50)), 1),
+                               "p95_ms": round(float(np.percentile(values, 95)), 1),
+                               "total_s": round(sum(values) / 1000, 1)} for phase, values in phases.items()},
+            "slowest": [{"name": name, "total_s": round(sum(by_phase.values()) / 1000, 1),
+                         "phases_s": {phase: round(ms / 1000, 1) for phase, ms in by_phase.items()}}
+                        for name, by_phase in slowest],
+            "entries_per_min": round(entries / duration * 60, 1) if duration > 0 else None,
+        }
+
+    def report(self, entries, duration):
+        """Print the end-of-run timing report, append it to the run file, end the run and return the report."""
+        summary = self.summary(entries, duration)
+        print(f"\n[TIMINGS] {entries} entries in {duration:.1f} s ({summary['entries_per_min']} entries/min)"
+              + (f", spans in {self.path}" if self.path else ""))
+        print(f"  {'phase':<12} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'total s':>9}")
+        for phase, stat in sorted(summary["phases"].items(), key=lambda item: -item[1]["total_s"]):
+            print(f"  {phase:<12} {stat['count']:>6} {stat['p50_ms']:>9.0f} {stat['p95_ms']:>9.0f} {stat['total_s']:>9.1f}")
+        if summary["slowest"]:
+            print("  Slowest entries:")
+            for item in summary["slowest"]:
+                parts = ", ".join(f"{phase} {sec}" for phase, sec in
+                                  sorted(item["phases_s"].items(), key=lambda p: -p[1]))
+                print(f"    {item['name']}: {item['total_s']} s ({parts})")
+        if self.path is not None:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"summary": summary}) + "\n")
+        logging.info(f"Run timings: {json.dumps(summary)}")
+        self.path = None  # the run is over: later spans must not land in its file or report
+        self.spans = []
+        return summary
+
+
+run_timings = RunTimings()
+
+
+class PhaseTimeout(Exception):
+    """An entry used up the PHASE_BUDGETS_S budget of one of its phases."""
+
+    def __init__(self, phase, budget):
+        super().__init__(f"{phase} exceeded its {budget:.0f} s budget")
+        self.phase = phase
+
+
+async def within_budget(phase, awaitable, extra_s=0):
+    """Await awaitable, cancelling it after the phase's budget (plus extra_s); raises PhaseTimeout."""
+    budget = PHASE_BUDGETS_S[phase] + extra_s
+    try:
+        return await asyncio.wait_for(awaitable, budget)
+    except asyncio.TimeoutError:
+        raise PhaseTimeout(phase, budget) from None
+
+
+def retry_delay(retry):
+    """Exponential backoff with full jitter for the retry-th retry (1-based)."""
+    return random.uniform(0, min(RETRY_MAX_DELAY_S, RETRY_BASE_DELAY_S * 2 ** (retry - 1)))
+
+
+async def take_screenshot(page: Page, path, clip, out=print):
+    """Capture clip into path once the page has settled.
+
+    Returns {"settle": <wait_for_settle result>, "digest": <pixel digest>} or None on failure;
+    raises PhaseTimeout when settling or capturing runs over its budget.
+    """
     #dpr = await page.evaluate("window.devicePixelRatio")
     #scaled_clip = {
        # "x": int(clip["x"] * HIGH_RESOLUTION_SCALE),
@@ -394,25 +1525,131 @@ async def take_screenshot(page: Page, path, clip):
        # "height": int(clip["height"] * HIGH_RESOLUTION_SCALE)
    # }
     #clip = scaled_clip
-    try:
+    name = Path(path).name
+
+    async def settle_page():
         await page.wait_for_load_state("domcontentloaded", timeout=30000)
-        await page.wait_for_load_state("networkidle", timeout=30000)
-        await page.wait_for_timeout(1000)        
-        await page.evaluate(f'window.scrollTo({clip["x"]}, {clip["y"]})')
-        await asyncio.sleep(2)
-        await page.screenshot(path=path, clip=clip, scale="device")
-        print(f"[SAVED] {path}")
+        return await wait_for_settle(page, clip["x"], clip["y"])
+
+    async def capture():
+        with run_timings.span(name, "capture"):
+            png = await page.screenshot(clip=clip, scale="device")
+        digest = await image_stage.run(save_bordered, png, path)
+        for phase, seconds in digest.pop("timings").items():
+            run_timings.record(name, phase, seconds)
+        return digest
 
+    try:
+        with run_timings.span(name, "settle"):
+            settle = await within_budget("settle", settle_page())
+        if not settle["settled"]:
+            out(f"[WARN] Page not stable after {SETTLE_TIMEOUT_MS} ms ({settle['state']}); capturing anyway")
+        logging.info(f"Settle for {Path(path).name}: {settle['ms']} ms (settled={settle['settled']})")
+        digest = await within_budget("capture", capture())
+        out(f"[SAVED] {path} (with black borders)")
+        return {"settle": settle, "digest": digest}
+
+    except PhaseTimeout:
+        raise
+    except Exception as e:
+        out(f"[ERROR] Failed to take screenshot {path}: {e}")
+        return None
 
-        with Image.open(path) as img:
-            bordered = ImageOps.expand(img, border=5, fill="black")
-            bordered.save(path)
 
-        print(f"[UPDATED] Added black borders")
+async def replay_tracking_urls(page, actions):
+    """Replay actions one at a time and return page.url as it was after each of them."""
+    network_tracker(page)
+    urls = []
+    for act in actions:
+        await replay_action(page, act)
+        urls.append(page.url)
+    return urls
 
 
-    except Exception as e:
-        print(f"[ERROR] Failed to take screenshot {path}: {e}")
+def deep_link_candidates(url, urls):
+    """Points where the replay landed on a new URL, latest first, as (position, url).
+
+    position is the index of the first action still needed after opening url directly.
+    """
+    candidates = []
+    current = url
+    for i, landed in enumerate(urls):
+        if landed != current:
+            candidates.append((i + 1, landed))
+            current = landed
+    return [(position, link) for position, link in reversed(candidates)
+            if link != url and LOGIN_URL_MARKER not in link and not link.startswith("about:")]
+
+
+async def find_deep_link(page: Page, entry, out=print):
+    """Find a URL the entry can open directly instead of clicking its way there.
+
+    The entry is replayed once with URL tracking and captured. Each URL it passed through
+    (latest first) is then opened directly, only the actions after it are replayed, and the
+    capture must match the full replay. Returns {"url", "position"} or None.
+    """
+    name, url, clip = entry["png_name"], entry["url"], entry["clip"]
+    actions = entry.get("actions", [])
+    if not await safe_goto(page, url):
+        return None
+    candidates = deep_link_candidates(url, await replay_tracking_urls(page, actions))
+    if not candidates:
+        out(f"[INFO] {name}: the actions never leave {url}")
+        return None
+
+    full = TEMP_SCREENSHOT_DIR / f"deeplink_full_{name}"
+    short = TEMP_SCREENSHOT_DIR / f"deeplink_{name}"
+    diff_path = TEMP_SCREENSHOT_DIR / f"diff_deeplink_{name}"
+    reference = await take_screenshot(page, full, clip, out=out)
+    if reference is None:
+        return None
+    try:
+        for position, link in candidates:
+            if not await safe_goto(page, link) or LOGIN_URL_MARKER in page.url:
+                out(f"[INFO] {name}: {link} cannot be opened directly")
+                continue
+            await replay_actions(page, actions[position:])
+            capture = await take_screenshot(page, short, clip, out=out)
+            if capture is None:
+                continue
+            same = capture["digest"]["pixels"] == reference["digest"]["pixels"] or not (
+                await image_stage.run(diff_images, full, short, diff_path, compare_options()))["changed"]
+            if same:
+                return {"url": link, "position": position}
+            out(f"[INFO] {name}: opening {link} directly gives a different capture")
+    finally:
+        for path in (full, short, diff_path):
+            path.unlink(missing_ok=True)
+    return None
+
+
+async def shortcut_entries(page: Page, entries, out=print):
+    """Rewrite entries to open their deep link and keep only the actions after it.
+
+    The first URL is kept as "original_url". Returns the names of the rewritten entries.
+    """
+    TEMP_SCREENSHOT_DIR.mkdir(exist_ok=True)
+    rewritten = []
+    for entry in entries:
+        if not entry.get("url") or not entry.get("png_name") or not entry.get("clip") or not entry.get("actions"):
+            continue
+        out(f"\n[INFO] Analysing {entry['png_name']} ({len(entry['actions'])} actions)")
+        try:
+            link = await find_deep_link(page, entry, out)
+        except PhaseTimeout as e:
+            out(f"[WARN] {entry['png_name']}: {e}")
+            link = None
+        if link is None:
+            continue
+        entry.setdefault("original_url", entry["url"])
+        entry["url"] = link["url"]
+        entry["actions"] = entry["actions"][link["position"]:]
+        rewritten.append(entry["png_name"])
+        out(f"[UPDATED] {entry['png_name']} -> {entry['url']} ({link['position']} actions dropped, "
+            f"{len(entry['actions'])} left)")
+        log_action("JSON_DEEPLINK", f"{entry['png_name']}: {entry['original_url']} -> {entry['url']}, "
+                                    f"dropped {link['position']} actions")
+    return rewritten
 
 
 async def run_json_editor(context, page: Page, recorded_events_buffer):
@@ -429,7 +1666,9 @@ async def run_json_editor(context, page: Page, recorded_events_buffer):
         print("2. Add entry")
         print("3. Remove entry")
         print("4. Edit entry")
-        print("5. Go to Main Menu")
+        print("5. Optimize recorded mouse paths")
+        print("6. Shortcut click paths to deep links")
+        print("7. Go to Main Menu")
         choice = input("Choose: ").strip()
 
         if choice == "1":
@@ -478,7 +1717,7 @@ async def run_json_editor(context, page: Page, recorded_events_buffer):
                 page, url = await get_current_url(context)
                 if not url or url.startswith("about:"):
                     print("[ACTION REQUIRED] No URL found in active tabs. Taking single.mcns.io as URL")
-                    url = "https://single.mcns.io"
+                    url = APP_URL
                     await page.goto(url, wait_until="networkidle", timeout=60000)
 
                 await page.bring_to_front()
@@ -500,6 +1739,8 @@ async def run_json_editor(context, page: Page, recorded_events_buffer):
                     print("[WARN] No actions recorded.")
 
                 actions = convert_events_to_actions(recorded_events_buffer)
+                if OPTIMIZE_RECORDED_ACTIONS:
+                    actions = optimize_actions(actions)
                 print(f"[INFO] Recorded {len(recorded_events_buffer)} raw events → {len(actions)} actions")
                 logging.info(f"Recorded {len(recorded_events_buffer)} raw events, {len(actions)} actions for {url}")
 
@@ -576,8 +1817,8 @@ async def run_json_editor(context, page: Page, recorded_events_buffer):
                     print("[ACTION] Log in if required")
                     if not entry['url'] or entry['url'].startswith("about:"):
                         print("[ACTION REQUIRED] No URL found. Taking single.mcns.io as URL")
-                        await page.goto("https://single.mcns.io", wait_until="networkidle", timeout=60000)
-                        entry["url"] = "https://single.mcns.io"
+                        await page.goto(APP_URL, wait_until="networkidle", timeout=60000)
+                        entry["url"] = APP_URL
                         log_action("JSON_EDIT", f"URL not found: Used default URL with {entry.get('png_name')} | URL={entry.get('url')} | Clip={entry.get('clip')}")
 
                     await page.bring_to_front()
@@ -597,6 +1838,8 @@ async def run_json_editor(context, page: Page, recorded_events_buffer):
                         
                     else:
                         actions = convert_events_to_actions(recorded_events_buffer)
+                        if OPTIMIZE_RECORDED_ACTIONS:
+                            actions = optimize_actions(actions)
                         entry["actions"] = actions
                         print(f"[INFO] Recorded {len(actions)} actions.")
                         logging.info(f"Re-recorded {len(actions)} actions for {entry['png_name']}")
@@ -620,6 +1863,31 @@ async def run_json_editor(context, page: Page, recorded_events_buffer):
                 print("[ERROR] Invalid index")
 
         elif choice == "5":
+            confirm = input("Rewrite recorded actions of all entries in place? (y/n): ").strip().lower()
+            if confirm == "y":
+                backup = JSON_FILE.with_suffix(".json.bak")
+                backup.write_text(JSON_FILE.read_text())
+                before, after = optimize_manifest(data)
+                save_json(data)
+                print(f"[UPDATED] {before} → {after} actions (backup: {backup})")
+                log_action("JSON_OPTIMIZE", f"Simplified mouse paths: {before} → {after} actions")
+            else:
+                print("[INFO] Entries unchanged.")
+
+        elif choice == "6":
+            selection = input("Entries to analyse (e.g. 1-3,6; Enter for all): ").strip()
+            entries = [data[i - 1] for i in parse_indices(selection, len(data))] if selection else data
+            backup = JSON_FILE.with_suffix(".json.bak")
+            backup.write_text(JSON_FILE.read_text())
+            rewritten = await shortcut_entries(page, entries)
+            if rewritten:
+                save_json(data)
+                wait_learner.forget(rewritten)
+                print(f"[UPDATED] {len(rewritten)} of {len(entries)} entries now open a deep link (backup: {backup})")
+            else:
+                print("[INFO] No entry could be shortened.")
+
+        elif choice == "7":
             return  # Go back to main menu
             loop = False  # Exit program        
         else:
@@ -627,14 +1895,98 @@ async def run_json_editor(context, page: Page, recorded_events_buffer):
 
 
 
-async def run_screenshots(page: Page, entries=None, selection_filter: str = None):
+class RunJournal:
+    """Append-only record of one screenshot run, RUNS_DIR/<run_id>.jsonl.
+
+    Each entry goes through "captured", "compared" and "decided"; every step is one JSON
+    line, flushed to disk before the run moves on. Passing the journal of an interrupted
+    run back to run_screenshots skips what it already finished.
+    """
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.path = RUNS_DIR / f"{run_id}.jsonl"
+
+    @classmethod
+    def start(cls, names):
+        RUNS_DIR.mkdir(exist_ok=True)
+        journal = cls(time.strftime("%Y%m%d-%H%M%S"))
+        journal.record("start", entries=names)
+        return journal
+
+    @classmethod
+    def resume(cls, run_id=None):
+        """Journal of run_id, or of the latest unfinished run; None when there is nothing to resume."""
+        if run_id:
+            journal = cls(run_id)
+            return journal if journal.path.exists() else None
+        for path in sorted(RUNS_DIR.glob("*.jsonl"), reverse=True):
+            journal = cls(path.stem)
+            if not journal.finished():
+                return journal
+        return None
+
+    def record(self, state, name=None, **data):
+        line = json.dumps({"state": state, "name": name, "time": round(time.time(), 3), **data})
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def records(self):
+        records = []
+        for line in self.path.read_text(encoding="utf-8").splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass  # line cut short by the crash
+        return records
+
+    def entries(self):
+        """PNG names of the run's entries, in run order."""
+        return next((r["entries"] for r in self.records() if r["state"] == "start"), [])
+
+    def states(self):
+        """{name: latest record of that entry, with the data of the earlier ones merged in}."""
+        states = {}
+        for record in self.records():
+            if record["name"] is not None:
+                states[record["name"]] = {**states.get(record["name"], {}), **record}
+        return states
+
+    def finished(self):
+        return any(r["state"] == "finished" for r in self.records())
+
+
+def entry_png_name(entry):
+    name = entry.get("png_name", "")
+    return name if name.lower().endswith(".png") else f"{name}.png"
+
+
+async def run_screenshots(page: Page, entries=None, selection_filter: str = None, decide=None, interactive=True,
+                          workers=CAPTURE_WORKERS, processes=CAPTURE_PROCESSES, journal=None):
+    """Capture, compare and review the selected entries and return a run summary.
+
+    decide(change) -> "replace" / "discard" / None replaces the review page (batch mode);
+    with interactive=False a login redirect fails the entry instead of waiting for a person.
+    processes > 1 captures on that many browser processes (run_process_pool) instead of
+    workers pages of page's browser; compare and review always run here.
+    journal (RunJournal.resume) continues an interrupted run: its entries are used, finished
+    ones are skipped and captures still in TEMP_SCREENSHOT_DIR are compared, not retaken.
+    """
+    started = time.time()
     ensure_json()
     data = load_json()
 
     # -------------------------------
     # Determine which entries to process
     # -------------------------------
-    if selection_filter:
+    if journal is not None:
+        by_name = {entry_png_name(entry): entry for entry in data}
+        names = journal.entries()
+        selected_data = [by_name[name] for name in names if name in by_name]
+        print(f"[INFO] Resuming run {journal.run_id} ({len(selected_data)} of {len(names)} entries still in the manifest).")
+    elif selection_filter:
         indices = set()
         for part in selection_filter.split(','):
             part = part.strip()
@@ -664,8 +2016,10 @@ async def run_screenshots(page: Page, entries=None, selection_filter: str = None
     # -------------------------------
     SCREENSHOT_DIR.mkdir(exist_ok=True)
     TEMP_SCREENSHOT_DIR.mkdir(exist_ok=True)
-    for file in TEMP_SCREENSHOT_DIR.glob("*.png"):
-        file.unlink()
+    if journal is None:
+        for file in TEMP_SCREENSHOT_DIR.glob("*.png"):
+            file.unlink()
+    # a resumed run still needs the captures an earlier attempt left there
 
     # -------------------------------
     # Fix missing extensions
@@ -677,246 +2031,1441 @@ async def run_screenshots(page: Page, entries=None, selection_filter: str = None
             logging.warning(f"Missing .png extension for {png_name}; fixed automatically.")
     save_json(data)
 
-    print("[INFO] Open the login page if required and log in manually.")
+    if interactive:
+        print("[INFO] Open the login page if required and log in manually.")
 
     # -------------------------------
-    # Main screenshot loop
+    # Run journal: what is already done
     # -------------------------------
-    for entry in selected_data:
-        url = entry.get("url")
-        png_name = entry.get("png_name")
-        clip = entry.get("clip")
+    results = [None] * len(selected_data)
+    compared = {}
+    decisions = {}
+    resumed = []  # (position, result) captured earlier and still waiting in TEMP_SCREENSHOT_DIR
+    to_capture = []
+    states = journal.states() if journal is not None else {}
+    for position, entry in enumerate(selected_data):
+        name = entry_png_name(entry)
+        record = states.get(name)
+        if record is None:
+            to_capture.append(position)
+            continue
+        result = {"entry": entry, **empty_capture_result(), "path": TEMP_SCREENSHOT_DIR / name,
+                  "settle_ms": record.get("settle_ms"), "digest": record.get("digest"), "navigation": "resumed"}
+        final = record["state"] == "decided" and record["decision"] is not None
+        if final or (record["state"] == "compared" and record["status"] != "changed"):
+            results[position] = result
+            compared[position] = {"name": name, "status": record["status"], "diff": {"score": record.get("score")}}
+            if final:
+                decisions[name] = record["decision"]
+        elif result["path"].exists():
+            results[position] = result
+            resumed.append((position, result))
+        else:
+            to_capture.append(position)
+    if journal is None:
+        journal = RunJournal.start([entry_png_name(entry) for entry in selected_data])
+        print(f"[INFO] Run {journal.run_id} (resume with this id if it gets interrupted)")
+    else:
+        print(f"[INFO] {len(selected_data) - len(to_capture) - len(resumed)} entries already finished, "
+              f"{len(resumed)} captures to compare, {len(to_capture)} entries to capture")
+    run_timings.start(journal.run_id)
 
-        if not url or not png_name or not clip:
-            print(f"[SKIP] Missing URL or PNG in entry: {entry}")
-            logging.warning(f"Missing URL or PNG name or clip for entry: {entry}; skipping.")
+    # -------------------------------
+    # Main screenshot loop (page pool)
+    # -------------------------------
+    # Every finished capture goes straight into the compare queue, so the diffs are
+    # computed while later entries are still being captured.
+    index = load_digest_index()
+    wait_learner.load()
+    compare_queue = asyncio.Queue(maxsize=COMPARE_QUEUE_SIZE)
+
+    async def enqueue(position, result):
+        journal.record("captured", result["path"].name, settle_ms=result["settle_ms"], digest=result["digest"])
+        await compare_queue.put((position, result))  # blocks capture pages when compare falls behind
+
+    async def fresh_capture(sub_position, result):
+        position = to_capture[sub_position]
+        results[position] = result
+        await enqueue(position, result)
+
+    async def comparer():
+        while True:
+            item = await compare_queue.get()
+            if item is None:
+                return
+            position, result = item
+            try:
+                compared[position] = await compare_capture(result["path"], result["digest"], index)
+                wait_learner.record_outcome(result["path"].name, compared[position]["status"])
+                diff = compared[position]["diff"]
+                journal.record("compared", result["path"].name, status=compared[position]["status"],
+                               score=diff["score"] if diff else None)
+            except Exception as e:
+                print(f"[ERROR] Compare failed for {result['path'].name}: {e}")
+                logging.error(f"Compare failed for {result['path'].name}: {e}")
+
+    comparers = [asyncio.create_task(comparer()) for _ in range(IMAGE_WORKERS)]
+    try:
+        for position, result in resumed:
+            await compare_queue.put((position, result))
+        pending = [selected_data[position] for position in to_capture]
+        if not pending:
+            fresh = []
+        elif processes > 1:
+            fresh = await run_process_pool(page, pending, processes, on_captured=fresh_capture, interactive=interactive)
+        else:
+            fresh = await run_capture_pool(page, pending, workers, on_captured=fresh_capture, interactive=interactive)
+        for position, result in zip(to_capture, fresh):
+            results[position] = result
+    finally:
+        for _ in comparers:
+            await compare_queue.put(None)
+        await asyncio.gather(*comparers)
+        save_digest_index(index)
+        wait_learner.save()
+
+    captured = sum(1 for r in results if r["path"])
+    pool = f"{processes} browser processes" if processes > 1 else f"{workers} pages"
+    logging.info(f"Captured {captured}/{len(results)} screenshots with {pool}.")
+    failures = [r for r in results if not r["path"]]
+    if failures:
+        print(f"\n[FAILURES] {len(failures)} entries could not be captured:")
+        for r in failures:
+            print(f"  {r['entry'].get('png_name')}: {r['error']} (phase: {r.get('phase') or '-'}, "
+                  f"attempts: {r.get('attempts', 1)})")
+        logging.error(f"{len(failures)} entries failed: {[r['entry'].get('png_name') for r in failures]}")
+    settle_times = [r["settle_ms"] for r in results if r["settle_ms"] is not None]
+    if settle_times:
+        print(f"[INFO] Settle time: avg {sum(settle_times) / len(settle_times):.0f} ms, max {max(settle_times)} ms")
+
+    changes = [compared[i] for i in sorted(compared)
+               if compared[i]["status"] == "changed" and compared[i]["name"] not in decisions]
+    try:
+        reviewed = await review_changes(page, changes, index, decide=decide)
+    finally:
+        save_digest_index(index)
+    for name, decision in reviewed.items():
+        journal.record("decided", name, decision=decision)
+    decisions.update(reviewed)
+    journal.record("finished")
+    logging.info(f"All selected screenshots processed and compared (run {journal.run_id}).")
+    image_stage.report()
+    duration = time.time() - started
+    summary = run_summary(results, compared, decisions, duration)
+    summary["run_id"] = journal.run_id
+    summary["timings"] = run_timings.report(len(selected_data), duration)
+    return summary
+
+
+def run_summary(results, compared, decisions, duration):
+    """Machine-readable outcome of a screenshot run."""
+    summary = {"entries": len(results), "captured": 0, "failed": [], "new": [], "unchanged": [], "changed": [],
+               "navigations_saved": sum(1 for r in results if r["navigation"] in ("reset", "continue")),
+               "duration_s": round(duration, 1)}
+    for position, result in enumerate(results):
+        name = result["entry"].get("png_name")
+        if not result["path"]:
+            summary["failed"].append({"name": name, "error": result.get("error"), "phase": result.get("phase"),
+                                      "attempts": result.get("attempts", 1)})
             continue
+        summary["captured"] += 1
+        change = compared.get(position)
+        if change is None:
+            summary["failed"].append({"name": name, "error": "compare failed"})
+        elif change["status"] == "changed":
+            summary["changed"].append({"name": name, "score": change["diff"]["score"],
+                                       "decision": decisions.get(change["name"])})
+        else:
+            summary[change["status"]].append(name)
+    return summary
+
+
+def empty_capture_result():
+    return {"path": None, "settle_ms": None, "digest": None, "error": None, "navigation": None, "phase": None}
+
+
+NON_RETRYABLE_ERRORS = ("missing url, png_name or clip", "login required")
+
+
+def should_retry(result):
+    """Whether a failed capture is worth another attempt later in the run."""
+    return result is None or (result["path"] is None and result["error"] not in NON_RETRYABLE_ERRORS)
+
+
+def mutates_state(entry):
+    """True when replaying the entry leaves state a soft reset cannot undo.
+
+    Typing and pointer presses change app state (open tabs, expanded rows, in-page route
+    changes soft_reset does not see when the URL stays the same); entries can also force a
+    reload with "reload": true. Only hovers and scrolling are undone by soft_reset.
+    """
+    return bool(entry.get("reload")) or any(a["type"] in STATE_MUTATING_ACTIONS for a in entry.get("actions", []))
+
+
+def action_key(act):
+    """Normalized form of an action for prefix sharing; pointer positions are quantized to PREFIX_POINT_BUCKET_PX."""
+    if "x" in act and "y" in act:
+        return (act["type"], round(act["x"] / PREFIX_POINT_BUCKET_PX), round(act["y"] / PREFIX_POINT_BUCKET_PX))
+    return json.dumps(act, sort_keys=True)
+
+
+def prefix_steps(actions):
+    """(key, end) for every action that changes what the page shows, end being the index after it.
+
+    Mouse moves and waits are left out: recordings of the same clicks never share the exact
+    path or timing of the cursor between them, so keying on them would share nothing.
+    """
+    return [(action_key(act), i + 1) for i, act in enumerate(actions) if act["type"] not in ("mousemove", "wait")]
+
+
+def _order_by_prefix(members):
+    """Order one route's entries by a depth-first walk of the trie over their prefix_steps.
+
+    Yields (position, entry, ends, ancestors) where ends are the action indices after each of
+    the entry's steps and ancestors the ids of the trie nodes on its path, so the planner can
+    tell when an entry continues exactly where an earlier one stopped.
+    """
+    root = {"children": {}, "entries": [], "id": 0}
+    next_id = 1
+    for position, entry in members:
+        node = root
+        steps = prefix_steps(entry.get("actions", []))
+        for key, _ in steps:
+            if key not in node["children"]:
+                node["children"][key] = {"children": {}, "entries": [], "id": next_id}
+                next_id += 1
+            node = node["children"][key]
+        node["entries"].append((position, entry, [end for _, end in steps]))
+
+    ordered = []
+    stack = [(root, (0,))]
+    while stack:
+        node, path = stack.pop()
+        for position, entry, ends in node["entries"]:
+            ordered.append((position, entry, ends, path))
+        for child in reversed(list(node["children"].values())):
+            stack.append((child, path + (child["id"],)))
+    return ordered
+
+
+def plan_schedule(entries):
+    """Group entries by URL and order each group to need as few navigations and replays as possible.
+
+    Returns a list of groups (first-appearance order of their URL); every group is a list of
+    steps {"position", "entry", "start", "skip", "keep_state"}. start is:
+      "goto"     full navigation, replay every action;
+      "reset"    in-app reset of the already loaded route (see soft_reset), replay every action;
+      "continue" the previous step's clicks, keys and scrolls are a prefix of this entry's, so
+                 the page is already in the intermediate state: replay only actions[skip:].
+    Steps are ordered along a prefix trie of the normalized actions (see prefix_steps), so
+    shared opening steps are replayed once and the intermediate states are captured in order. keep_state
+    tells the step to leave the page as it found it for a following "continue" step.
+    Entries that mutate state force a full navigation before the next unrelated step.
+    """
+    groups = {}
+    for position, entry in enumerate(entries):
+        groups.setdefault(entry.get("url"), []).append((position, entry))
+    plan = []
+    for members in groups.values():
+        members.sort(key=lambda m: mutates_state(m[1]))  # stable: keeps manifest order otherwise
+        steps = []
+        last_path = None
+        dirty = False
+        for position, entry, ends, path in _order_by_prefix(members):
+            # A previous entry without steps shares nothing; its hovers still need a reset
+            if last_path is not None and len(last_path) > 1 and path[:len(last_path)] == last_path:
+                start, skip = "continue", ends[len(last_path) - 2]
+                steps[-1]["keep_state"] = True
+            else:
+                reuse = ROUTE_SOFT_RESET and steps and not dirty
+                start, skip = ("reset" if reuse else "goto"), 0
+                dirty = False
+            dirty = dirty or mutates_state(entry)
+            steps.append({"position": position, "entry": entry, "start": start, "skip": skip, "keep_state": False})
+            last_path = path
+        plan.append(steps)
+    return plan
+
+
+RESET_ROUTE_JS = r"""
+(url) => {
+  if (document.activeElement && document.activeElement.blur) document.activeElement.blur();
+  if (location.href !== url) {
+    // Let the SPA router handle the route change instead of reloading the document
+    history.pushState(null, '', url);
+    window.dispatchEvent(new PopStateEvent('popstate', { state: null }));
+  }
+  window.scrollTo(0, 0);
+  return location.href;
+}
+"""
+
+
+async def soft_reset(page: Page, url):
+    """Return an already loaded route to its initial state without a reload. False when that did not work."""
+    try:
+        await page.keyboard.press("Escape")  # close menus/dialogs left open by the previous entry
+        await page.mouse.move(0, 0)
+        landed = await page.evaluate(RESET_ROUTE_JS, url)
+        await page.wait_for_load_state("domcontentloaded", timeout=10000)
+        return landed == url and LOGIN_URL_MARKER not in page.url
+    except Exception as e:
+        logging.warning(f"Soft reset to {url} failed: {e}")
+        return False
+
+
+FICLONE = 0x40049409  # Linux ioctl for a copy-on-write clone of a whole file
+PROFILE_CLONE_MARKER = ".cloned"  # Written into a clone when it is complete; its mtime is the clone time
+PROFILE_LOCK_FILES = {"SingletonLock", "SingletonSocket", "SingletonCookie", "lockfile", "LOCK"}
+PROFILE_CACHE_DIRS = {"Cache", "Code Cache", "GPUCache", "GrShaderCache", "GraphiteDawnCache", "ShaderCache",
+                      "DawnCache", "DawnGraphiteCache", "DawnWebGPUCache", "CacheStorage", "ScriptCache",
+                      "component_crx_cache", "Crashpad"}
+PROFILE_AUTH_ENTRIES = {"Cookies", "Cookies-journal", "Local Storage", "Session Storage", "IndexedDB",
+                        "Login Data", "Login Data-journal", "Login Data For Account", "Login Data For Account-journal"}
+# Component data Chromium replaces by renaming whole versioned directories, never by writing
+# into the files; hardlinking it into a clone cannot change the golden profile.
+PROFILE_STATIC_DIRS = {"Extensions", "WidevineCdm", "hyphen-data", "ZxcvbnData", "Safe Browsing", "MEIPreload",
+                       "FileTypePolicies", "CertificateRevocation", "SSLErrorAssistant", "Subresource Filter",
+                       "OriginTrials", "TrustTokenKeyCommitments", "OnDeviceHeadSuggestModel",
+                       "optimization_guide_model_store", "pnacl", "Dictionaries"}
+RESET_MODES = ("cache", "auth", "all")
+
+
+class ProfileManager:
+    """Clones the golden profile into per-worker user-data dirs and resets profiles selectively.
+
+    Chromium will not open one user-data dir from two processes, so every worker gets a
+    clone with its own cache and cookies. Files are reflinked (copy-on-write) where the
+    filesystem supports it, static component directories are hardlinked, and everything
+    else is copied. Caches and lock files are never cloned.
+    """
 
-        print(f"\nTaking {png_name} screenshot for {url}")
-        logging.warning(f"Taking screenshot for: {png_name}: {url}")
+    def __init__(self, golden=USERDATA_DIR, root=PROFILES_DIR):
+        self.golden = Path(golden)
+        self.root = Path(root)
+        self.reflinks = fcntl is not None  # switched off after the first unsupported attempt
+
+    def path(self, name):
+        return self.root / name
+
+    def clone(self, name):
+        """(Re)create profile name from the golden profile. Returns its directory."""
+        if not self.golden.exists():
+            raise FileNotFoundError(f"Golden profile {self.golden} does not exist; log in once first")
+        dest = self.path(name)
+        if dest.exists():
+            shutil.rmtree(dest)
+        counts = {"reflink": 0, "hardlink": 0, "copy": 0}
+        started = time.time()
+        for root, dirs, files in os.walk(self.golden):
+            rel = Path(root).relative_to(self.golden)
+            dirs[:] = [d for d in dirs if d not in PROFILE_CACHE_DIRS]
+            (dest / rel).mkdir(parents=True, exist_ok=True)
+            static = any(part in PROFILE_STATIC_DIRS for part in rel.parts)
+            for file in files:
+                if file not in PROFILE_LOCK_FILES:
+                    counts[self._clone_file(Path(root) / file, dest / rel / file, static)] += 1
+        (dest / PROFILE_CLONE_MARKER).touch()
+        logging.info(f"Cloned {self.golden} to {dest} in {time.time() - started:.1f}s: {counts}")
+        return dest
+
+    def _clone_file(self, src, dst, static):
+        if self.reflinks:
+            try:
+                with open(src, "rb") as s, open(dst, "wb") as d:
+                    fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                shutil.copystat(src, dst)
+                return "reflink"
+            except OSError:
+                self.reflinks = False
+        if static:
+            try:
+                dst.unlink(missing_ok=True)
+                os.link(src, dst)
+                return "hardlink"
+            except OSError:
+                pass  # other filesystem, or links not allowed
+        try:
+            shutil.copy2(src, dst)
+        except OSError as e:
+            logging.warning(f"Could not clone {src}: {e}")  # e.g. a file the running browser keeps locked
+        return "copy"
+
+    def worker_profile(self, name, fresh=False):
+        """User-data dir for profile name, reusing an earlier clone (with its warm cache).
+
+        The profile is cloned again when fresh, when no complete clone exists, or when the
+        golden profile's login state changed after the clone was made.
+        """
+        dest = self.path(name)
+        if fresh or self._stale(dest):
+            return self.clone(name)
+        for lock in PROFILE_LOCK_FILES:
+            (dest / lock).unlink(missing_ok=True)  # left behind by a browser that did not exit cleanly
+        return dest
+
+    def _stale(self, dest):
+        marker = dest / PROFILE_CLONE_MARKER
+        if not marker.exists():
+            return True
+        cloned = marker.stat().st_mtime
+        for base in (self.golden, self.golden / "Default"):
+            for name in PROFILE_AUTH_ENTRIES:
+                entry = base / name
+                if entry.exists() and entry.stat().st_mtime > cloned:
+                    return True
+        return False
+
+    def reset(self, profile_dir, mode="cache"):
+        """Delete the caches ("cache"), the login state ("auth") or the whole profile ("all")."""
+        if mode not in RESET_MODES:
+            raise ValueError(f"Unknown reset mode {mode!r}; expected one of {RESET_MODES}")
+        profile_dir = Path(profile_dir)
+        if not profile_dir.exists():
+            return 0
+        if mode == "all":
+            shutil.rmtree(profile_dir)
+            return 1
+        names = PROFILE_CACHE_DIRS if mode == "cache" else PROFILE_AUTH_ENTRIES
+        removed = 0
+        for root, dirs, files in os.walk(profile_dir):
+            for name in [d for d in dirs if d in names]:
+                shutil.rmtree(Path(root) / name, ignore_errors=True)
+                dirs.remove(name)
+                removed += 1
+            for name in files:
+                if name in names:
+                    (Path(root) / name).unlink(missing_ok=True)
+                    removed += 1
+        logging.info(f"Reset {mode} of profile {profile_dir}: {removed} entries removed")
+        return removed
+
+
+profile_manager = ProfileManager()
+
+
+class SessionManager:
+    """Shares one logged-in session between pages, contexts and processes.
+
+    The session is exported once with context.storage_state() to SESSION_STATE_FILE and
+    injected into fresh (headless) contexts by new_context(). ensure() checks it before a
+    run; when a page still lands on the login page, login() holds every page in ready()
+    until one person has logged in, then pushes the new cookies into all tracked contexts.
+    """
 
+    def __init__(self, state_file=SESSION_STATE_FILE):
+        self.state_file = Path(state_file)
+        self.generation = 0  # bumped by every completed login
+        self.contexts = weakref.WeakSet()
+        self._lock = None
+        self._idle = None
+
+    def _sync(self):
+        # Created lazily so they belong to the running event loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._idle = asyncio.Event()
+            self._idle.set()
+
+    def expired(self):
+        """True when there is no stored state or one of its cookies for APP_URL is (nearly) expired."""
         try:
-            await page.goto(url, wait_until="networkidle", timeout=60000)
-            if "saml_login" in page.url:
-                print("[INFO] Redirected to login page. Please log in manually.")
-                await page.wait_for_url("**/single.mcns.io/**", timeout=0)
+            cookies = json.loads(self.state_file.read_text())["cookies"]
+        except (OSError, ValueError, KeyError):
+            return True
+        host = urlparse(APP_URL).hostname or ""
+        cookies = [c for c in cookies if host.endswith(c.get("domain", "").lstrip("."))]
+        deadline = time.time() + SESSION_EXPIRY_MARGIN_S
+        return not cookies or any(0 < c.get("expires", -1) < deadline for c in cookies)
+
+    async def new_context(self, browser, **options):
+        """A fresh context carrying the stored session (if there is one)."""
+        state = str(self.state_file) if self.state_file.exists() else None
+        context = await browser.new_context(storage_state=state, **options)
+        self.contexts.add(context)
+        return context
+
+    async def export(self, context):
+        """Write the context's cookies and storage to state_file, readable by the owner only."""
+        state = await context.storage_state()
+        fd = os.open(self.state_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.chmod(self.state_file, 0o600)  # the mode above only applies when the file is created
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f, indent=2)
+        logging.info(f"Exported session state with {len(state['cookies'])} cookies to {self.state_file}")
+        return state
+
+    async def ready(self):
+        """Wait while a login is in progress."""
+        self._sync()
+        await self._idle.wait()
+
+    async def ensure(self, page, interactive=True):
+        """Check the session once before a run, logging in (interactive only) when it has expired.
+
+        Returns False when the run cannot proceed without a login.
+        """
+        self._sync()
+        self.contexts.add(page.context)
+        seen = self.generation
+        try:
+            await page.goto(APP_URL, wait_until="domcontentloaded", timeout=60000)
         except Exception as e:
-            print(f"[ERROR] Failed to open {url}: {e}")
-            logging.warning(f"Failed to open: {url}")
-            continue
+            print(f"[WARN] Could not check the session on {APP_URL}: {e}")
+            return True  # let the entries report their own navigation errors
+        if LOGIN_URL_MARKER not in page.url:
+            if self.expired():
+                await self.export(page.context)
+            return True
+        return await self.login(page, seen, interactive)
+
+    async def login(self, page, seen, interactive=True):
+        """Have one person log in on page for everyone who saw generation seen.
+
+        Callers arriving while a login is running wait for it and reuse its result.
+        """
+        self._sync()
+        async with self._lock:
+            if self.generation != seen:
+                return True  # someone logged in while we waited
+            if not interactive:
+                print(f"[ERROR] The session has expired; run `python {Path(sys.argv[0]).name} login` to log in again")
+                logging.error("Login required during a non-interactive run")
+                return False
+            self._idle.clear()
+            try:
+                print("[INFO] Redirected to login page. Please log in manually.")
+                await page.bring_to_front()
+                await page.wait_for_url(f"**/{urlparse(APP_URL).hostname}/**", timeout=0)
+                state = await self.export(page.context)
+                for context in list(self.contexts):
+                    if context is not page.context:
+                        await context.add_cookies(state["cookies"])
+                self.generation += 1
+            finally:
+                self._idle.set()
+        return True
+
+
+session_manager = SessionManager()
+
+
+async def open_entry_url(page: Page, url, out, result, server_slots, session, interactive=True, name=None):
+    """Full navigation to url, waiting for (or failing on) a SAML login. Records errors in result."""
+    try:
+        with run_timings.span(name, "login wait", min_ms=1):
+            await session.ready()
+        seen = session.generation
+        async with server_slots:
+            with run_timings.span(name, "navigate"):
+                await within_budget("navigate", page.goto(url, wait_until="networkidle", timeout=60000))
+        if LOGIN_URL_MARKER in page.url:
+            # Only one page waits for the manual login; the others retry once it is done
+            with run_timings.span(name, "login wait"):
+                logged_in = await session.login(page, seen, interactive)
+            if not logged_in:
+                out(f"[ERROR] Login required for {url}; no one to log in during a batch run")
+                logging.error(f"Login required for {url} in batch mode")
+                result["error"] = "login required"
+                return False
+            if LOGIN_URL_MARKER in page.url or page.url != url:
+                async with server_slots:
+                    with run_timings.span(name, "navigate"):
+                        await within_budget("navigate", page.goto(url, wait_until="networkidle", timeout=60000))
+    except PhaseTimeout:
+        raise
+    except Exception as e:
+        out(f"[ERROR] Failed to open {url}: {e}")
+        logging.warning(f"Failed to open: {url}")
+        result.update(error=f"navigation failed: {e}", phase="navigate")
+        return False
+    return True
+
+
+async def capture_entry(page: Page, entry, out, server_slots, session, interactive=True, start="goto",
+                        skip=0, keep_state=False):
+    """Navigate, replay and capture a single entry. Messages go to out() so they can be printed in order.
+
+    start="reset" reuses the route already loaded in page (see plan_schedule) and falls
+    back to a full navigation when the in-app reset does not land on the entry's URL.
+    start="continue" keeps the page as the previous step left it and replays only
+    actions[skip:]. keep_state restores the scroll position after the capture.
+    Returns {"path", "settle_ms", "digest", "error", "navigation"}; path is None when the
+    entry could not be captured. Each phase runs within its PHASE_BUDGETS_S budget; an entry
+    that runs over gets the phase in result["phase"].
+    """
+    result = empty_capture_result()
+    url = entry.get("url")
+    png_name = entry.get("png_name")
+    clip = entry.get("clip")
+
+    if not url or not png_name or not clip:
+        out(f"[SKIP] Missing URL or PNG in entry: {entry}")
+        logging.warning(f"Missing URL or PNG name or clip for entry: {entry}; skipping.")
+        result["error"] = "missing url, png_name or clip"
+        return result
+
+    out(f"\nTaking {png_name} screenshot for {url}")
+    logging.warning(f"Taking screenshot for: {png_name}: {url}")
+    name = entry_png_name(entry)
+    network_tracker(page)  # track requests from the navigation on, so settle sees the ones still in flight
+
+    try:
+        if start == "reset":
+            with run_timings.span(name, "navigate"):
+                reset = await within_budget("navigate", soft_reset(page, url))
+        if start == "continue":
+            result["navigation"] = "continue"
+            logging.info(f"Continuing from the previous entry's state for {png_name} ({skip} shared actions)")
+        elif start == "reset" and reset:
+            result["navigation"] = "reset"
+            logging.info(f"Reused loaded route for {png_name}: {url}")
+        else:
+            skip = 0
+            result["navigation"] = "goto"
+            if not await open_entry_url(page, url, out, result, server_slots, session, interactive, name=name):
+                return result
         if not png_name.lower().endswith(".png"):
-            png_name += ".png"  
+            png_name += ".png"
 
         path = TEMP_SCREENSHOT_DIR / png_name
         logging.warning(f"png_name saved to TEMP_SCREENSHOT_DIR.")
 
-        actions = entry.get("actions", [])
+        actions = entry.get("actions", [])[skip:]
+        if skip:
+            out(f"[INFO] {skip} shared actions already replayed for {png_name}")
         if actions:
-            print(f"[INFO] Replaying {len(actions)} actions for {png_name}")
-            await replay_actions(page, actions)
+            out(f"[INFO] Replaying {len(actions)} actions for {png_name}")
+            recorded_waits = sum(act["ms"] for act in actions if act["type"] == "wait") / 1000
+            with run_timings.span(name, "replay"):
+                await within_budget("replay", replay_actions(page, actions, waits=wait_learner.plan(png_name, offset=skip)),
+                                    extra_s=recorded_waits)
             logging.warning(f"Replayed {len(actions)} actions for {png_name}")
         else:
-            print(f"[INFO] No recorded actions for {png_name} — skipping replay.")
+            out(f"[INFO] No recorded actions for {png_name} — skipping replay.")
             logging.info(f"No recorded actions for {png_name} — skipping replay.")
 
-        await take_screenshot(page, path, clip)
+        scroll = await page.evaluate("[window.scrollX, window.scrollY]") if keep_state else None
+        async with server_slots:
+            capture = await take_screenshot(page, path, clip, out=out)
+        if scroll:
+            await page.evaluate("([x, y]) => window.scrollTo(x, y)", scroll)
+        if capture is None:
+            result.update(error="screenshot failed", phase="capture")
+            return result
         logging.info(f"Screenshot taken for {png_name} at {path}")
-
-    await compare_and_prompt(page)
-    logging.info("All selected screenshots processed and compared.")
+        result.update(path=path, settle_ms=capture["settle"]["ms"], digest=capture["digest"])
+        out(f"[INFO] Settled in {capture['settle']['ms']} ms")
+        return result
+    except PhaseTimeout as e:
+        out(f"[TIMEOUT] {png_name}: {e}")
+        logging.warning(f"{png_name}: {e}")
+        result.update(error=str(e), phase=e.phase)
+        return result
+
+
+async def capture_group(page: Page, group, server_slots, interactive=False):
+    """Capture one route group of plan_schedule in order; yields (step, result, lines) per step.
+
+    A step that fails leaves the page in an unknown state, so the steps after it do a full
+    navigation instead of the reset/continue they were planned with. A step's "delay" (set
+    for retries) is waited before it starts.
+    """
+    broken = False
+    for step in group:
+        entry = step["entry"]
+        start, skip = ("goto", 0) if broken else (step["start"], step["skip"])
+        lines = []
+        if step.get("delay"):
+            await asyncio.sleep(step["delay"])
+        try:
+            result = await capture_entry(page, entry, lines.append, server_slots, session_manager,
+                                         interactive, start=start, skip=skip, keep_state=step["keep_state"])
+        except Exception as e:
+            lines.append(f"[ERROR] Capture failed for {entry.get('png_name')}: {e}")
+            logging.error(f"Capture failed for {entry.get('png_name')}: {e}")
+            result = {**empty_capture_result(), "error": str(e)}
+        broken = result["path"] is None
+        yield step, result, lines
 
 
+async def run_capture_pool(page: Page, entries, workers: int = CAPTURE_WORKERS, on_captured=None, interactive=True):
+    """Capture entries on a pool of pages in the same context; output and results stay in entry order.
 
+    Pages take whole route groups from plan_schedule, so entries sharing a URL reuse the loaded
+    route. on_captured(index, result) is awaited for every successful capture as soon as it lands.
+    Failed entries are requeued at the end, each with its own full navigation and a jittered
+    backoff, until they have had RETRY_ATTEMPTS tries; result["attempts"] counts them.
+    """
+    plan = plan_schedule(entries)
+    steps = [step for group in plan for step in group]
+    planned_resets = sum(step["start"] != "goto" for step in steps)
+    print(f"[INFO] Route schedule: {len(entries)} entries on {len(plan)} routes, "
+          f"{planned_resets} full navigations replaced by in-app resets or shared prefixes, "
+          f"{sum(step['skip'] for step in steps)} shared actions replayed only once")
+    workers = max(1, min(workers, len(plan)))
+    if not await session_manager.ensure(page, interactive):
+        return [{"entry": entry, "lines": [], **empty_capture_result(), "error": "login required"} for entry in entries]
+    pages = [page] + [await page.context.new_page() for _ in range(workers - 1)]
+    server_slots = asyncio.Semaphore(MAX_CONCURRENT_CAPTURES)
+
+    queue = asyncio.Queue()
+    for group in plan:
+        queue.put_nowait(group)
+
+    results = [None] * len(entries)
+    next_to_print = 0
+
+    def flush():
+        nonlocal next_to_print
+        while next_to_print < len(results) and results[next_to_print] is not None:
+            for line in results[next_to_print]["lines"]:
+                print(line)
+            next_to_print += 1
+
+    async def worker(worker_page, attempt):
+        while True:
+            try:
+                group = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            async for step, result, lines in capture_group(worker_page, group, server_slots, interactive):
+                index = step["position"]
+                results[index] = {"entry": step["entry"], "lines": lines, **result, "attempts": attempt}
+                if attempt == 1:
+                    flush()
+                else:
+                    for line in lines:  # the first round's output is already printed
+                        print(line)
+                if on_captured and result["path"]:
+                    await on_captured(index, results[index])
 
-async def compare_and_prompt(page: Page):
-    """Compare screenshots one by one, show single browser preview, and ask user in CLI to replace or discard."""
+    try:
+        await asyncio.gather(*(worker(p, 1) for p in pages))
+        for attempt in range(2, RETRY_ATTEMPTS + 1):
+            retry = [i for i, r in enumerate(results) if should_retry(r)]
+            if not retry:
+                break
+            print(f"\n[RETRY] Attempt {attempt}/{RETRY_ATTEMPTS} for {len(retry)} failed entries")
+            logging.warning(f"Retrying {len(retry)} entries (attempt {attempt})")
+            for i in retry:
+                queue.put_nowait([{"position": i, "entry": entries[i], "start": "goto", "skip": 0,
+                                   "keep_state": False, "delay": retry_delay(attempt - 1)}])
+            await asyncio.gather(*(worker(p, attempt) for p in pages[:len(retry)]))
+    finally:
+        for extra in pages[1:]:
+            await extra.close()
+    saved = sum(1 for r in results if r and r["navigation"] in ("reset", "continue"))
+    print(f"[INFO] Navigations saved by route reuse: {saved} of {len(entries)}")
+    logging.info(f"Route reuse saved {saved} navigations ({planned_resets} planned)")
+    return results
+
+
+async def open_capture_context(p, headless, viewport, profile):
+    """Browser context for unattended capture: a fresh one with the stored session while that is
+    valid, else a persistent context on the clone of the golden profile named profile (see
+    ProfileManager.worker_profile).
+
+    Returns (browser, context); browser is None for persistent contexts.
+    """
+    if not session_manager.expired():
+        browser = await p.chromium.launch(headless=headless)
+        context = await session_manager.new_context(browser, viewport=viewport, device_scale_factor=HIGH_RESOLUTION_SCALE)
+        return browser, context
+    context = await p.chromium.launch_persistent_context(
+        user_data_dir=str(profile_manager.worker_profile(profile) if profile_manager.golden.exists()
+                          else profile_manager.path(profile)),
+        headless=headless,
+        viewport=viewport,
+        device_scale_factor=HIGH_RESOLUTION_SCALE,
+    )
+    return None, context
+
+
+def capture_process(worker_id, work, done, options):
+    """Entry point of a capture worker process started by run_process_pool."""
+    # Output travels back through done; keep stray prints off stdout, which may carry a JSON summary
+    with contextlib.redirect_stdout(sys.stderr):
+        asyncio.run(_capture_process(worker_id, work, done, options))
+
+
+async def _capture_process(worker_id, work, done, options):
+    # This process is one of several already; encode on a thread instead of another process pool
+    image_stage.workers = 0
+    wait_learner.load()
+    loop = asyncio.get_running_loop()
+    try:
+        async with async_playwright() as p:
+            # Chromium will not share a profile between processes: every worker gets its own clone
+            browser, context = await open_capture_context(p, options["headless"], options["viewport"],
+                                                           f"worker-{worker_id}")
+            page = context.pages[0] if context.pages else await context.new_page()
+            server_slots = asyncio.Semaphore(MAX_CONCURRENT_CAPTURES)
+            try:
+                while True:
+                    group = await loop.run_in_executor(None, work.get)
+                    if group is None:
+                        break
+                    async for step, result, lines in capture_group(page, group, server_slots):
+                        waits = wait_learner.runs.pop(result["path"].name, None) if result["path"] else None
+                        if waits is not None:
+                            result["waits"] = [waits.observed, waits.shortened]
+                        result["spans"] = run_timings.take()
+                        done.put({"position": step["position"], "worker": worker_id, "lines": lines, **result})
+            finally:
+                await context.close()
+                if browser:
+                    await browser.close()
+    except Exception as e:
+        logging.error(f"Capture process {worker_id} stopped: {e}")
+    finally:
+        image_stage.shutdown()
+        done.put({"finished": worker_id})
 
-    # Create or reuse one tab for preview
-    compare_tab = await page.context.new_page()
 
-    for tmp_file in TEMP_SCREENSHOT_DIR.glob("*.png"):
-        main_file = SCREENSHOT_DIR / tmp_file.name
+async def run_process_pool(page: Page, entries, processes=CAPTURE_PROCESSES, on_captured=None, interactive=True):
+    """Capture entries on several processes, each driving its own Chromium; results come back here.
 
-        # If old screenshot doesn’t exist — just move it
-        if not main_file.exists():
-            tmp_file.replace(main_file)
-            print(f"[NEW] Saved new screenshot: {main_file.name}")
+    Route groups from plan_schedule are handed out through a queue, so busy workers just take
+    fewer groups. page stays with this process: it checks the session before the workers start
+    (they share it through SESSION_STATE_FILE) and recaptures, with run_capture_pool's retries,
+    the entries that a worker could not: failed ones, those needing a login and those lost
+    with a crashed worker.
+    """
+    plan = plan_schedule(entries)
+    processes = max(1, min(processes, len(plan)))
+    if not await session_manager.ensure(page, interactive):
+        return [{"entry": entry, "lines": [], **empty_capture_result(), "error": "login required"} for entry in entries]
+    await session_manager.export(page.context)
+
+    ctx = multiprocessing.get_context("spawn")  # forking a process that drives Playwright is not safe
+    work, done = ctx.Queue(), ctx.Queue()
+    for group in plan:
+        work.put(group)
+    for _ in range(processes):
+        work.put(None)
+    options = {"headless": True, "viewport": page.viewport_size or parse_viewport(BATCH_VIEWPORT)}
+    workers = [ctx.Process(target=capture_process, args=(i, work, done, options), daemon=True)
+               for i in range(1, processes + 1)]
+    for worker in workers:
+        worker.start()
+    print(f"[INFO] Capturing {len(entries)} entries ({len(plan)} routes) on {processes} browser processes")
+
+    results = [None] * len(entries)
+    loop = asyncio.get_running_loop()
+    finished = set()
+    while len(finished) < processes:
+        try:
+            message = await loop.run_in_executor(None, done.get, True, CAPTURE_PROCESS_CHECK_S)
+        except Empty:
+            # A killed worker never reports back; its unfinished entries are recaptured below
+            for worker_id, worker in enumerate(workers, 1):
+                if worker_id not in finished and not worker.is_alive():
+                    logging.error(f"Capture process {worker_id} exited with code {worker.exitcode}")
+                    finished.add(worker_id)
+            continue
+        if "finished" in message:
+            finished.add(message["finished"])
             continue
+        index = message.pop("position")
+        waits = message.pop("waits", None)
+        run_timings.add(message.pop("spans"))
+        result = results[index] = {"entry": entries[index], **message}
+        for line in result["lines"]:
+            print(line)
+        if waits is not None:
+            wait_learner.adopt(result["path"].name, *waits)
+        if on_captured and result["path"]:
+            await on_captured(index, result)
+    for worker in workers:
+        await loop.run_in_executor(None, worker.join)
+
+    retry = [i for i, r in enumerate(results) if r is None or r["error"] == "login required" or should_retry(r)]
+    if retry:
+        print(f"[INFO] Recapturing {len(retry)} entries here that the workers could not capture")
+
+        async def retried(position, result):
+            await on_captured(retry[position], result)
+
+        again = await run_capture_pool(page, [entries[i] for i in retry], 1,
+                                       on_captured=retried if on_captured else None, interactive=interactive)
+        for i, result in zip(retry, again):
+            results[i] = result
+    logging.info(f"Process pool: {processes} workers, {len(retry)} entries recaptured in the coordinator")
+    return results
+
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    steps TEXT NOT NULL,              -- JSON route group from plan_schedule
+    state TEXT NOT NULL,              -- pending / leased / done / failed
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_run_state ON jobs (run_id, state);
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    png BLOB,
+    result TEXT NOT NULL,             -- JSON: worker, timings, digest, navigation, error
+    PRIMARY KEY (run_id, position)
+);
+"""
 
-        # Compare old and new
-        img1 = Image.open(main_file).convert("RGB")
-        img2 = Image.open(tmp_file).convert("RGB")
-        diff = ImageChops.difference(img1, img2)
 
-        if diff.getbbox() is None:
-            print(f"[NO CHANGE] {main_file.name} — identical, discarding new image.")
-            tmp_file.unlink()
-            continue
+class JobQueue:
+    """Durable capture jobs in SQLite, shared by a coordinator and capture nodes.
+
+    The database must be on a local disk: claims rely on SQLite locking, which network
+    shares do not implement reliably. One job is one route group of plan_schedule. A worker
+    claims a job with a lease and keeps it alive with heartbeat(); a job whose lease runs out
+    is handed out again until it has been claimed JOB_MAX_ATTEMPTS times. Captures come back
+    as PNG bytes plus timings in the results table.
+    """
 
-        # Save diff image
-        diff_path = TEMP_SCREENSHOT_DIR / f"diff_{tmp_file.name}"
-        diff.save(diff_path)
+    def __init__(self, path=JOBS_DB):
+        self.db = sqlite3.connect(str(path), timeout=30, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(JOBS_SCHEMA)
 
-        # Prepare HTML for visual comparison
-        html = f"""
+    def close(self):
+        self.db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")  # one writer at a time, so two nodes never claim the same job
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def submit(self, run_id, plan):
+        now = time.time()
+        with self._transaction():
+            self.db.executemany("INSERT INTO jobs (run_id, steps, state, updated) VALUES (?, ?, 'pending', ?)",
+                                [(run_id, json.dumps(group), now) for group in plan])
+
+    def _expire(self, run_id, now):
+        self.db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                        "error = COALESCE(error, 'lease expired'), worker = NULL, lease_until = NULL, updated = ? "
+                        "WHERE run_id = ? AND state = 'leased' AND lease_until < ?",
+                        (JOB_MAX_ATTEMPTS, now, run_id, now))
+
+    def expire_leases(self, run_id):
+        """Requeue (or fail, after JOB_MAX_ATTEMPTS) the jobs whose worker stopped heartbeating.
+
+        claim() does this too, but the coordinator calls it as well, so a job held by a dead
+        node is settled even when no other node is left to claim it.
+        """
+        with self._transaction():
+            self._expire(run_id, time.time())
+
+    def claim(self, run_id, worker):
+        """Lease the next job of run_id to worker. Returns (job_id, steps) or None."""
+        now = time.time()
+        with self._transaction():
+            self._expire(run_id, now)
+            row = self.db.execute("SELECT id, steps FROM jobs WHERE run_id = ? AND state = 'pending' "
+                                  "ORDER BY attempts, id LIMIT 1", (run_id,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                            "updated = ? WHERE id = ?", (worker, now + JOB_LEASE_S, now, row["id"]))
+        return row["id"], json.loads(row["steps"])
+
+    def heartbeat(self, job_id, worker):
+        """Extend the lease; False when the job was meanwhile handed to someone else."""
+        cursor = self.db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                                 (time.time() + JOB_LEASE_S, job_id, worker))
+        return cursor.rowcount == 1
+
+    def store_result(self, run_id, position, name, png, result):
+        self.db.execute("INSERT OR REPLACE INTO results (run_id, position, name, png, result) VALUES (?, ?, ?, ?, ?)",
+                        (run_id, position, name, png, json.dumps(result)))
+
+    def complete(self, job_id, worker):
+        self.db.execute("UPDATE jobs SET state = 'done', lease_until = NULL, updated = ? WHERE id = ? AND worker = ?",
+                        (time.time(), job_id, worker))
+
+    def fail(self, job_id, worker, error):
+        """Give the job back for another attempt, or fail it for good after JOB_MAX_ATTEMPTS."""
+        self.db.execute("UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                        "error = ?, worker = NULL, lease_until = NULL, updated = ? WHERE id = ? AND worker = ?",
+                        (JOB_MAX_ATTEMPTS, error, time.time(), job_id, worker))
+
+    def release(self, job_id, worker):
+        """Give the job back without counting the attempt, for failures of the worker, not the job."""
+        self.db.execute("UPDATE jobs SET state = 'pending', attempts = MAX(0, attempts - 1), worker = NULL, "
+                        "lease_until = NULL, updated = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                        (time.time(), job_id, worker))
+
+    def counts(self, run_id):
+        rows = self.db.execute("SELECT state, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY state", (run_id,))
+        return {state: count for state, count in rows}
+
+    def latest_run(self):
+        row = self.db.execute("SELECT run_id FROM jobs WHERE state IN ('pending', 'leased') "
+                              "ORDER BY id DESC LIMIT 1").fetchone()
+        return row["run_id"] if row else None
+
+    def results(self, run_id):
+        return self.db.execute("SELECT position, name, png, result FROM results WHERE run_id = ?", (run_id,)).fetchall()
+
+    def failures(self, run_id):
+        """{position: error} for the entries of jobs that failed for good."""
+        failed = {}
+        for row in self.db.execute("SELECT steps, error FROM jobs WHERE run_id = ? AND state = 'failed'", (run_id,)):
+            for step in json.loads(row["steps"]):
+                failed[step["position"]] = row["error"]
+        return failed
+
+
+class LoginRequired(Exception):
+    """The capture node's session has expired; the job itself did nothing wrong."""
+
+
+async def capture_job(queue, run_id, worker, page, steps, server_slots):
+    """Capture one claimed job and store every entry's PNG bytes and timings in the queue.
+
+    Failed entries are recaptured at the end of the job, each with its own full navigation
+    and a jittered backoff, until they have had RETRY_ATTEMPTS tries (as run_capture_pool
+    does at the end of a run).
+    """
+    group, attempt = steps, 1
+    while True:
+        retry = []
+        started = time.perf_counter()
+        async for step, result, lines in capture_group(page, group, server_slots):
+            for line in lines:
+                print(line)
+            if result["error"] == "login required":
+                raise LoginRequired("login required")  # another node may still have a valid session
+            png = None
+            if result["path"]:
+                png = result["path"].read_bytes()
+                result["path"].unlink()
+            queue.store_result(run_id, step["position"], result["path"].name if result["path"] else None, png, {
+                "worker": worker,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000),
+                "settle_ms": result["settle_ms"],
+                "digest": result["digest"],
+                "navigation": result["navigation"],
+                "error": result["error"],
+                "phase": result.get("phase"),
+                "attempts": attempt,
+                "spans": run_timings.take(),
+            })
+            if should_retry(result):
+                retry.append(step)
+            started = time.perf_counter()
+        if not retry or attempt == RETRY_ATTEMPTS:
+            return
+        attempt += 1
+        print(f"\n[RETRY] Attempt {attempt}/{RETRY_ATTEMPTS} for {len(retry)} failed entries")
+        logging.warning(f"Retrying {len(retry)} entries of a job on {worker} (attempt {attempt})")
+        group = [{**step, "start": "goto", "skip": 0, "keep_state": False, "delay": retry_delay(attempt - 1)}
+                 for step in retry]
+
+
+async def keep_lease(queue, job_id, worker):
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_S)
+        if not queue.heartbeat(job_id, worker):
+            logging.warning(f"Lost the lease on job {job_id}; another worker may capture it again")
+            return
+
+
+async def collect_run(queue, run_id, entries, decide, started):
+    """Compare and review the captures the nodes stored for run_id. Returns the run summary."""
+    TEMP_SCREENSHOT_DIR.mkdir(exist_ok=True)
+    SCREENSHOT_DIR.mkdir(exist_ok=True)
+    run_timings.start(run_id)
+    results = [{"entry": entry, **empty_capture_result(), "error": "not captured"} for entry in entries]
+    for position, error in queue.failures(run_id).items():
+        results[position]["error"] = f"job failed: {error}"
+    for row in queue.results(run_id):
+        result = results[row["position"]]
+        stored = json.loads(row["result"])
+        result.update({key: stored[key] for key in ("settle_ms", "digest", "navigation", "error")},
+                      worker=stored["worker"], elapsed_ms=stored["elapsed_ms"],
+                      phase=stored.get("phase"), attempts=stored.get("attempts", 1))
+        run_timings.add(stored.get("spans", []))
+        if row["png"] is not None:
+            result["path"] = TEMP_SCREENSHOT_DIR / row["name"]
+            result["path"].write_bytes(row["png"])
+
+    index = load_digest_index()
+    captured = [position for position, result in enumerate(results) if result["path"]]
+    outcomes = await asyncio.gather(*(compare_capture(results[i]["path"], results[i]["digest"], index)
+                                      for i in captured), return_exceptions=True)
+    compared = {}
+    for position, outcome in zip(captured, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"[ERROR] Compare failed for {results[position]['path'].name}: {outcome}")
+            logging.error(f"Compare failed for {results[position]['path'].name}: {outcome}")
+        else:
+            compared[position] = outcome
+    changes = [compared[i] for i in sorted(compared) if compared[i]["status"] == "changed"]
+    try:
+        decisions = await review_changes(None, changes, index, decide=decide)
+    finally:
+        save_digest_index(index)
+    image_stage.report()
+    duration = time.time() - started
+    summary = run_summary(results, compared, decisions, duration)
+    summary["timings"] = run_timings.report(len(entries), duration)
+    return summary
+
+
+async def compare_capture(tmp_file, new_digest, index):
+    """Compare one capture with its baseline.
+
+    New and unchanged captures are settled right away (moved / discarded); changed ones are
+    left in TEMP_SCREENSHOT_DIR for review. Returns a dict with "status" ("new", "unchanged",
+    "changed"), the file paths, the digest and, for changes, the diff result.
+    """
+    main_file = SCREENSHOT_DIR / tmp_file.name
+    change = {"name": tmp_file.name, "tmp_file": tmp_file, "main_file": main_file, "status": None, "diff": None}
+    if new_digest is None:
+        new_digest = await image_stage.run(image_digest, tmp_file)
+    change["digest"] = new_digest
+
+    # If old screenshot doesn’t exist — just move it
+    if not main_file.exists():
+        tmp_file.replace(main_file)
+        index[main_file.name] = {**new_digest, "stamp": file_stamp(main_file)}
+        print(f"[NEW] Saved new screenshot: {main_file.name}")
+        change["status"] = "new"
+        return change
+
+    # Fast path: identical pixel hash means no change, baseline is never decoded
+    old_digest = await baseline_digest(index, main_file)
+    if old_digest["pixels"] == new_digest["pixels"]:
+        print(f"[NO CHANGE] {main_file.name} — identical, discarding new image.")
+        tmp_file.unlink()
+        change["status"] = "unchanged"
+        return change
+    distance = phash_distance(old_digest, new_digest)
+    if distance is not None:
+        logging.info(f"Perceptual distance for {main_file.name}: {distance}")
+
+    # Compare old and new (diff image is written by the image stage)
+    diff_path = TEMP_SCREENSHOT_DIR / f"diff_{tmp_file.name}"
+    keys = {"old": old_digest["pixels"], "new": new_digest["pixels"]}
+    with run_timings.span(tmp_file.name, "diff"):
+        diff = await image_stage.run(diff_images, main_file, tmp_file, diff_path, compare_options(), keys)
+    if not diff["changed"]:
+        print(f"[NO CHANGE] {main_file.name} — no visual change ({diff['mode']}), discarding new image.")
+        tmp_file.unlink()
+        change["status"] = "unchanged"
+        return change
+    print(f"[CHANGED] {main_file.name}: {len(diff['tiles'])} tiles, {diff['changed_pixels']} pixels differ "
+          f"(score {diff['score']:.5f})")
+    change.update(status="changed", diff=diff, diff_path=diff_path)
+    return change
+
+
+REVIEW_PAGE_HTML = r"""
 <html>
 <head>
+<meta charset="utf-8">
+<title>Screenshot review</title>
 <style>
-  body {{
-    background: #222;
-    color: #fff;
-    font-family: sans-serif;
-    text-align: center;
-    margin: 0;
-    overflow-x: hidden;
-  }}
-  h2 {{
-    color: #ffd700;
-    margin-top: 20px;
-  }}
-  .container {{
-    display: flex;
-    flex-direction: row;
-    justify-content: center;
-    align-items: flex-start;
-    gap: 20px;
-    padding: 20px;
-  }}
-  .images {{
-    flex: 3;
-  }}
-  .zoom-preview {{
-    flex: 1;
-    border: 3px solid #555;
-    background: #111;
-    width: 600px;
-    height: 400px;
-    overflow: hidden;
-    position: sticky;
-    top: 50px;
-  }}
-  .zoom-preview h3 {{
-    color: #0ff;
-    font-size: 16px;
-    margin: 5px 0;
-  }}
-  img {{
-    max-width: 45%;
-    border: 3px solid #444;
-    margin: 10px;
-  }}
+  body { background: #222; color: #fff; font-family: sans-serif; margin: 0; }
+  header { position: sticky; top: 0; z-index: 2; background: #111; padding: 10px 20px; border-bottom: 2px solid #444; }
+  header h2 { color: #ffd700; margin: 0 0 4px 0; }
+  header .keys { color: #aaa; font-size: 13px; }
+  main { display: flex; gap: 20px; padding: 20px; }
+  .items { flex: 3; }
+  .item { border: 3px solid #444; border-radius: 6px; margin-bottom: 20px; padding: 10px; }
+  .item.current { border-color: #0ff; }
+  .item.replace { background: #1d3320; }
+  .item.discard { background: #3a1d1d; }
+  .item h3 { margin: 0 0 8px 0; }
+  .item .meta { color: #aaa; font-size: 13px; }
+  .item .status { float: right; font-weight: bold; }
+  .images { display: flex; gap: 10px; }
+  .images div { flex: 1; text-align: center; }
+  .images img { width: 100%; border: 2px solid #555; }
+  .images a { color: #0ff; font-size: 12px; }
+  details { margin-top: 8px; }
+  .patch { display: flex; gap: 10px; margin: 6px 0; }
+  .patch img { max-width: 32%; border: 2px solid #555; }
+  .zoom-preview { flex: 1; border: 3px solid #555; background: #111; width: 400px; height: 400px; position: sticky; top: 90px; }
+  .zoom-preview h3 { color: #0ff; font-size: 16px; margin: 5px 0; text-align: center; }
+  button { font-size: 15px; padding: 6px 14px; }
 </style>
 </head>
 <body>
-<h2>Compare: {tmp_file.name}</h2>
-
-<div class="container">
-  <div class="images">
-    <div>
-      <h3>Old</h3>
-      <img id="imgOld" src="file:///{main_file.resolve()}" />
-    </div>
-    <div>
-      <h3>New</h3>
-      <img id="imgNew" src="file:///{tmp_file.resolve()}" />
-    </div>
-    <div>
-      <h3>Diff</h3>
-      <img id="imgDiff" src="file:///{diff_path.resolve()}" />
-    </div>
-  </div>
-
-  <div class="zoom-preview" id="zoomBox">
+<header>
+  <h2>Review: <span id="count"></span> changed screenshots (largest change first)</h2>
+  <div class="keys">j / &darr; next &middot; k / &uarr; previous &middot; r replace &middot; d discard &middot;
+    u undo &middot; R replace all undecided &middot; D discard all undecided &middot; Enter submit
+    <button id="submit">Submit decisions</button> <span id="progress"></span></div>
+</header>
+<main>
+  <div class="items" id="items"></div>
+  <div class="zoom-preview">
     <h3>Zoom preview</h3>
     <canvas id="zoomCanvas" width="400" height="370"></canvas>
   </div>
-</div>
-
+</main>
 <script>
-function enableFixedZoom(imgIDs, zoom = 2) {{
-  const zoomCanvas = document.getElementById("zoomCanvas");
-  const ctx = zoomCanvas.getContext("2d");
-  const zoomBox = document.getElementById("zoomBox");
-
-  imgIDs.forEach(id => {{
-    const img = document.getElementById(id);
-    img.addEventListener("mousemove", e => showZoom(e, img));
-    img.addEventListener("mouseleave", clearZoom);
-  }});
-
-  function showZoom(e, img) {{
+const items = __ITEMS__;
+const decisions = {};
+let current = 0;
+const list = document.getElementById("items");
+document.getElementById("count").textContent = items.length;
+
+items.forEach((item, i) => {
+  const section = document.createElement("section");
+  section.className = "item";
+  section.id = "item-" + i;
+  section.innerHTML = `
+    <span class="status"></span>
+    <h3>${i + 1}. ${item.name}</h3>
+    <div class="meta">score ${item.score.toFixed(5)} &middot; ${item.tiles} changed tiles &middot; ${item.pixels} pixels</div>
+    <div class="images">
+      ${["old", "new", "diff"].map(side => `
+        <div><h4>${side[0].toUpperCase() + side.slice(1)}${item.full[side] ? ` <a href="${item.full[side]}" target="_blank">full size</a>` : ""}</h4>
+        <img data-index="${i}" data-side="${side}" src="${item.preview[side]}"></div>`).join("")}
+    </div>
+    <details><summary>Changed regions (${item.patches.length}, full resolution)</summary>
+      ${item.patches.map(p => `<div class="patch">${["old", "new", "diff"].map(side => `<img loading="lazy" src="${p[side]}">`).join("")}</div>`).join("")}
+    </details>`;
+  section.addEventListener("click", () => select(i));
+  list.appendChild(section);
+});
+
+function refresh() {
+  items.forEach((item, i) => {
+    const section = document.getElementById("item-" + i);
+    const decision = decisions[item.name];
+    section.className = "item" + (i === current ? " current" : "") + (decision ? " " + decision : "");
+    section.querySelector(".status").textContent = decision ? decision.toUpperCase() : "";
+  });
+  const done = Object.keys(decisions).length;
+  document.getElementById("progress").textContent = `${done} / ${items.length} decided`;
+}
+
+function select(i) {
+  current = Math.max(0, Math.min(items.length - 1, i));
+  document.getElementById("item-" + current).scrollIntoView({ block: "start", behavior: "smooth" });
+  refresh();
+}
+
+function decide(decision) {
+  const name = items[current].name;
+  if (decision) decisions[name] = decision; else delete decisions[name];
+  if (decision && current < items.length - 1) select(current + 1); else refresh();
+}
+
+function decideRest(decision) {
+  items.forEach(item => { if (!decisions[item.name]) decisions[item.name] = decision; });
+  refresh();
+}
+
+function submit() {
+  const undecided = items.length - Object.keys(decisions).length;
+  if (undecided && !confirm(`${undecided} screenshots are undecided and will be kept for later. Submit?`)) return;
+  window.submitReviewDecisions(decisions).then(() => {
+    document.querySelector("main").innerHTML = "<h2>Decisions sent. You can close this tab.</h2>";
+  });
+}
+
+document.addEventListener("keydown", e => {
+  if (e.key === "j" || e.key === "ArrowDown") { select(current + 1); e.preventDefault(); }
+  else if (e.key === "k" || e.key === "ArrowUp") { select(current - 1); e.preventDefault(); }
+  else if (e.key === "r") decide("replace");
+  else if (e.key === "d") decide("discard");
+  else if (e.key === "u") decide(null);
+  else if (e.key === "R") decideRest("replace");
+  else if (e.key === "D") decideRest("discard");
+  else if (e.key === "Enter") submit();
+});
+document.getElementById("submit").addEventListener("click", submit);
+
+// Zoom draws from the small preview, or from the full-resolution patch when the cursor is
+// over a changed region. Patch images are loaded once per item, never per mouse move.
+const zoomCanvas = document.getElementById("zoomCanvas");
+const ctx = zoomCanvas.getContext("2d");
+const patchImages = {};
+
+function patchesFor(index) {
+  if (!patchImages[index]) {
+    patchImages[index] = items[index].patches.map(p => {
+      const old = new Image(), neu = new Image(), diff = new Image();
+      old.src = p.old;
+      neu.src = p.new;
+      diff.src = p.diff;
+      return { ...p, images: { old: old, new: neu, diff: diff } };
+    });
+  }
+  return patchImages[index];
+}
+
+document.querySelectorAll(".images img").forEach(img => {
+  img.addEventListener("mouseenter", () => patchesFor(+img.dataset.index));
+  img.addEventListener("mousemove", e => {
+    const item = items[+img.dataset.index];
     const rect = img.getBoundingClientRect();
-    const x = e.clientX - rect.left;
-    const y = e.clientY - rect.top;
-    const scaleX = img.naturalWidth / img.width;
-    const scaleY = img.naturalHeight / img.height;
-    const realX = x * scaleX;
-    const realY = y * scaleY;
-
-    const zoomSize = 150;
-    const sx = Math.max(0, realX - zoomSize / 2);
-    const sy = Math.max(0, realY - zoomSize / 2);
-    const sWidth = zoomSize;
-    const sHeight = zoomSize;
-
-    const imgElement = new Image();
-    imgElement.src = img.src;
-    imgElement.onload = () => {{
-      ctx.clearRect(0, 0, zoomCanvas.width, zoomCanvas.height);
-      ctx.imageSmoothingEnabled = true;
-      ctx.imageSmoothingQuality = 'high';
-      ctx.drawImage(
-        imgElement,
-        sx, sy, sWidth, sHeight,
-        0, 0, zoomCanvas.width, zoomCanvas.height
-      );
-    }};
-  }}
-
-  function clearZoom() {{
+    const zoomSize = 150 * item.scale;  // full-resolution pixels shown in the box
+    const fullX = (e.clientX - rect.left) * item.fullWidth / img.width;
+    const fullY = (e.clientY - rect.top) * item.fullWidth / img.width;
     ctx.clearRect(0, 0, zoomCanvas.width, zoomCanvas.height);
-  }}
-}}
+    ctx.imageSmoothingEnabled = true;
+    ctx.imageSmoothingQuality = "high";
+    const patch = patchesFor(+img.dataset.index).find(p =>
+      fullX >= p.x && fullX < p.x + p.width && fullY >= p.y && fullY < p.y + p.height);
+    const source = patch && patch.images[img.dataset.side];
+    if (source && source.complete && source.naturalWidth) {
+      ctx.drawImage(source, Math.max(0, fullX - patch.x - zoomSize / 2), Math.max(0, fullY - patch.y - zoomSize / 2),
+                    zoomSize, zoomSize, 0, 0, zoomCanvas.width, zoomCanvas.height);
+    } else {
+      const ratio = img.naturalWidth / item.fullWidth;
+      ctx.drawImage(img, Math.max(0, (fullX - zoomSize / 2) * ratio), Math.max(0, (fullY - zoomSize / 2) * ratio),
+                    zoomSize * ratio, zoomSize * ratio, 0, 0, zoomCanvas.width, zoomCanvas.height);
+    }
+  });
+  img.addEventListener("mouseleave", () => ctx.clearRect(0, 0, zoomCanvas.width, zoomCanvas.height));
+});
 
-enableFixedZoom(["imgOld", "imgNew", "imgDiff"], 2);
+select(0);
 </script>
-
 </body>
 </html>
 """
 
 
+def apply_decision(change, decision, index):
+    """Replace the baseline with the capture or discard the capture."""
+    tmp_file, main_file = change["tmp_file"], change["main_file"]
+    if decision == "replace":
+        tmp_file.replace(main_file)
+        index[main_file.name] = {**change["digest"], "stamp": file_stamp(main_file)}
+        print(f"[REPLACED] {tmp_file.name}")
+    elif decision == "discard":
+        tmp_file.unlink()
+        print(f"[DISCARDED] {tmp_file.name}")
+    else:
+        print(f"[UNDECIDED] {tmp_file.name} — kept in {TEMP_SCREENSHOT_DIR}")
+    logging.info(f"Review decision for {tmp_file.name}: {decision or 'undecided'}")
+
+
+def review_item(change):
+    """Data the review page needs for one change; previews fall back to the full-size files.
 
+    The diff file is only drawn at preview size (see diff_canvas), so it gets no "full size"
+    link; the full-resolution difference of every changed region is in its patches.
+    """
+    def url(path):
+        return f"file:///{Path(path).resolve()}"
+
+    diff = change["diff"]
+    full = {"old": url(change["main_file"]), "new": url(change["tmp_file"])}
+    assets = diff.get("assets")
+    if assets:
+        preview = {side: url(path) for side, path in assets["previews"].items()}
+        patches = [{**p, **{side: url(p[side]) for side in ("old", "new", "diff")}} for p in assets["patches"]]
+        full_width = assets["full_size"][0]
+    else:
+        preview, patches, full_width = {**full, "diff": url(change["diff_path"])}, [], None
+    return {
+        "name": change["name"],
+        "score": diff["score"],
+        "tiles": len(diff["tiles"]),
+        "pixels": diff["changed_pixels"],
+        "full": full,
+        "preview": preview,
+        "patches": patches,
+        "fullWidth": full_width or PREVIEW_WIDTH,
+        "scale": HIGH_RESOLUTION_SCALE,
+    }
 
 
-        # Write temporary HTML to file
-        html_path = TEMP_SCREENSHOT_DIR / f"compare_{tmp_file.stem}.html"
-        html_path.write_text(html, encoding="utf-8")
+async def review_changes(page: Page, changes, index, decide=None):
+    """Review all changed captures on one page, sorted by diff score, and apply the decisions in bulk.
 
-        # Load it in the same tab
-        print(f"\n[COMPARE] Showing {tmp_file.name} in browser...")
-        await compare_tab.goto(f"file:///{html_path.resolve()}")
-        await asyncio.sleep(1)
+    Decisions come back from the page through the submitReviewDecisions binding; closing the
+    tab without submitting leaves every capture undecided. When decide is given it is called
+    for every change instead of showing the page. Returns {name: decision}.
+    """
+    if not changes:
+        print("\n[INFO] All comparisons completed.")
+        return {}
+    changes = sorted(changes, key=lambda c: c["diff"]["score"], reverse=True)
+    if decide is not None:
+        decisions = {c["name"]: decide(c) for c in changes}
+        for change in changes:
+            apply_decision(change, decisions[change["name"]], index)
+        return decisions
+
+    items = [review_item(c) for c in changes]
 
-        # CLI prompt for user decision
-        while True:
-            choice = input("\nReplace or Discard this screenshot? (r/d): ").strip().lower()
-            if choice == "r":
-                tmp_file.replace(main_file)
-                print(f"[REPLACED] {tmp_file.name}")
-                break
-            elif choice == "d":
-                tmp_file.unlink()
-                print(f"[DISCARDED] {tmp_file.name}")
-                break
-            else:
-                print("Invalid input. Please enter 'r' or 'd'.")
+    compare_tab = await page.context.new_page()
+    submitted = asyncio.get_running_loop().create_future()
+
+    def on_submit(decisions):
+        if not submitted.done():
+            submitted.set_result(decisions)
+
+    def on_close(_):
+        if not submitted.done():
+            submitted.set_result({})
+
+    await compare_tab.expose_function("submitReviewDecisions", on_submit)
+    compare_tab.on("close", on_close)
+
+    html_path = TEMP_SCREENSHOT_DIR / "review.html"
+    html_path.write_text(REVIEW_PAGE_HTML.replace("__ITEMS__", json.dumps(items)), encoding="utf-8")
+    print(f"\n[REVIEW] {len(changes)} changed screenshots — decide in the browser tab "
+          f"(r replace, d discard, Enter submit)...")
+    await compare_tab.goto(f"file:///{html_path.resolve()}")
+    await compare_tab.bring_to_front()
 
-    await compare_tab.close()
+    with run_timings.span(None, "review wait"):
+        decisions = await submitted
+    for change in changes:
+        apply_decision(change, decisions.get(change["name"]), index)
+
+    if not compare_tab.is_closed():
+        await compare_tab.close()
     print("\n[INFO] All comparisons completed.")
+    return decisions
+
 
+def load_review_rules(path):
+    """Read auto-review rules: {"default": decision, "rules": [{"match", "max_score", "min_score", "decision"}]}."""
+    rules = json.loads(Path(path).read_text())
+    for rule in rules.get("rules", []):
+        if rule.get("decision") not in ("replace", "discard", None):
+            raise ValueError(f"Invalid decision in review rule {rule}")
+    return rules
 
 
+def make_rule_decider(rules):
+    """decide(change) for review_changes: the first rule whose pattern and score range match wins."""
+    def decide(change):
+        score = change["diff"]["score"]
+        for rule in rules.get("rules", []):
+            if not fnmatch.fnmatch(change["name"], rule.get("match", "*")):
+                continue
+            if "max_score" in rule and score > rule["max_score"]:
+                continue
+            if "min_score" in rule and score < rule["min_score"]:
+                continue
+            return rule.get("decision")
+        return rules.get("default")
+    return decide
+
 
 
 
@@ -955,9 +3504,17 @@ async def main():
                 print("\n[SCREENSHOT MODE]")
                 print("1. Take all screenshots as per JSON")
                 print("2. Take selected screenshots from JSON")
+                print("3. Resume an interrupted run")
                 sub_choice = input("\nChoose: ").strip()
                 if sub_choice == "1":
                     await run_screenshots(page)
+                elif sub_choice == "3":
+                    run_id = input("Run id (Enter for the latest unfinished run): ").strip()
+                    journal = RunJournal.resume(run_id or None)
+                    if journal is None:
+                        print("[ERROR] No run to resume.")
+                        continue
+                    await run_screenshots(page, journal=journal)
                 elif sub_choice == "2":
                     
                     print("\nSaved Entries: ")
@@ -991,11 +3548,8 @@ async def main():
                 try:
                     await page.wait_for_load_state("domcontentloaded", timeout=15000)
                     await asyncio.sleep(1)                    
-                    await page.screenshot(path=path, full_page=True, scale="device")
-
-                    with Image.open(path) as img:
-                        bordered = ImageOps.expand(img, border=5, fill="black")
-                        bordered.save(path)
+                    png = await page.screenshot(full_page=True, scale="device")
+                    await image_stage.run(save_bordered, png, path)
 
                     print(f"[SAVED] Full-page screenshot saved as {png_name}")
                     logging.info(f"Captured full-page screenshot: {png_name}")
@@ -1010,8 +3564,266 @@ async def main():
                 print("[ERROR] Invalid choice")
 
         await context.close()
+        image_stage.shutdown()
+
+
+
+def parse_viewport(value):
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Viewport must look like 1920x1080, got {value!r}")
+    return {"width": width, "height": height}
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Screenshot automation. Run without arguments for the interactive menu.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    capture = commands.add_parser("capture", help="Capture screenshots unattended (headless, no prompts)")
+    which = capture.add_mutually_exclusive_group(required=True)
+    which.add_argument("--all", action="store_true", help="Capture every entry in screenshots.json")
+    which.add_argument("--select", metavar="INDICES", help="1-based indices, e.g. 1-3,6,9-10")
+    which.add_argument("--resume", nargs="?", const="", metavar="RUN_ID",
+                       help="Continue an interrupted run (default: the latest unfinished one)")
+    capture.add_argument("--headed", action="store_true", help="Show the browser window")
+    capture.add_argument("--viewport", type=parse_viewport, default=BATCH_VIEWPORT, help="Fixed viewport, default %(default)s")
+    capture.add_argument("--workers", type=int, default=CAPTURE_WORKERS, help="Pages capturing in parallel")
+    capture.add_argument("--processes", type=int, default=CAPTURE_PROCESSES,
+                         help="Browser processes capturing in parallel (each with its own Chromium)")
+    capture.add_argument("--rules", metavar="FILE", help="JSON auto-review rules used instead of the review page")
+    capture.add_argument("--accept-all", action="store_true", help="Replace every changed baseline")
+    capture.add_argument("--summary", metavar="FILE", help="Write the JSON run summary here (default: stdout)")
+    capture.set_defaults(run=run_batch)
+
+    coordinate = commands.add_parser("coordinate", help="Queue entries for capture nodes, then compare and review")
+    which = coordinate.add_mutually_exclusive_group(required=True)
+    which.add_argument("--all", action="store_true", help="Capture every entry in screenshots.json")
+    which.add_argument("--select", metavar="INDICES", help="1-based indices, e.g. 1-3,6,9-10")
+    coordinate.add_argument("--db", type=Path, default=JOBS_DB, help="Job database shared with the nodes (local disk only)")
+    coordinate.add_argument("--rules", metavar="FILE", help="JSON auto-review rules")
+    coordinate.add_argument("--accept-all", action="store_true", help="Replace every changed baseline")
+    coordinate.add_argument("--summary", metavar="FILE", help="Write the JSON run summary here (default: stdout)")
+    coordinate.set_defaults(run=run_coordinator)
+
+    worker = commands.add_parser("worker", help="Capture node: claim queued jobs and store the captures")
+    worker.add_argument("--db", type=Path, default=JOBS_DB, help="Job database shared with the coordinator (local disk only)")
+    worker.add_argument("--run", help="Run id to work on (default: the latest run with open jobs)")
+    worker.add_argument("--id", help="Worker name shown in leases and results (default: host-pid)")
+    worker.add_argument("--headed", action="store_true", help="Show the browser window")
+    worker.add_argument("--viewport", type=parse_viewport, default=BATCH_VIEWPORT, help="Fixed viewport, default %(default)s")
+    worker.set_defaults(run=run_worker)
+
+    login = commands.add_parser("login", help=f"Log in once and export the session to {SESSION_STATE_FILE}")
+    login.set_defaults(run=run_login)
+
+    profile = commands.add_parser("profile", help="Clone the golden profile for workers or reset profiles")
+    profile.add_argument("action", choices=["clone", "reset"])
+    profile.add_argument("--name", help=f"Profile under {PROFILES_DIR} (default: clone worker-1..N / reset the golden profile)")
+    profile.add_argument("--workers", type=int, default=CAPTURE_WORKERS, help="Worker profiles to clone")
+    profile.add_argument("--mode", choices=RESET_MODES, default="cache", help="What to reset, default %(default)s")
+    profile.set_defaults(run=run_profile)
+    return parser
+
+
+def select_entries(args):
+    """Manifest entries chosen with --all / --select, or None when the selection is empty."""
+    ensure_json()
+    data = load_json()
+    if args.all:
+        return data
+    entries = [data[i - 1] for i in parse_indices(args.select, len(data))]
+    if not entries:
+        print("[ERROR] No valid indices selected.", file=sys.stderr)
+        return None
+    return entries
+
+
+def batch_decider(args):
+    """decide(change) for unattended runs from --accept-all / --rules."""
+    if args.accept_all:
+        rules = {"default": "replace"}
+    elif args.rules:
+        rules = load_review_rules(args.rules)
+    else:
+        rules = {"default": None}  # leave every change in screenshots_tmp for a person
+    return make_rule_decider(rules)
+
 
+def report_summary(summary, args):
+    """Add the exit code to summary, write it out and return the code."""
+    pending = [c for c in summary["changed"] if c["decision"] != "replace"]
+    summary["exit_code"] = EXIT_FAILURES if summary["failed"] else EXIT_CHANGES_PENDING if pending else EXIT_OK
+    report = json.dumps(summary, indent=4)
+    if args.summary:
+        Path(args.summary).write_text(report)
+    else:
+        print(report)
+    logging.info(f"{args.command} run finished with exit code {summary['exit_code']}")
+    return summary["exit_code"]
+
+
+async def run_batch(args):
+    """Non-interactive capture for CI/cron. Returns the process exit code."""
+    journal = entries = None
+    if args.resume is not None:
+        journal = RunJournal.resume(args.resume or None)
+        if journal is None:
+            print(f"[ERROR] No run to resume in {RUNS_DIR}.", file=sys.stderr)
+            return EXIT_FAILURES
+    else:
+        entries = select_entries(args)
+        if entries is None:
+            return EXIT_FAILURES
+    decide = batch_decider(args)
+
+    viewport = args.viewport  # argparse also runs the string default through parse_viewport
+    with contextlib.redirect_stdout(sys.stderr):  # stdout carries only the JSON summary
+        async with async_playwright() as p:
+            # A clone, so a batch run never competes with the interactive browser for the profile
+            browser, context = await open_capture_context(p, not args.headed, viewport, "batch")
+            page = context.pages[0] if context.pages else await context.new_page()
+            try:
+                summary = await run_screenshots(page, entries=entries, decide=decide,
+                                                interactive=False, workers=max(1, args.workers),
+                                                processes=max(1, args.processes), journal=journal)
+            finally:
+                await context.close()
+                if browser:
+                    await browser.close()
+                image_stage.shutdown()
+    return report_summary(summary, args)
+
+
+async def run_coordinator(args):
+    """Queue the selected entries as jobs, wait for the capture nodes, then compare and review."""
+    entries = select_entries(args)
+    if entries is None:
+        return EXIT_FAILURES
+    decide = batch_decider(args)
+    with contextlib.redirect_stdout(sys.stderr):  # stdout carries only the JSON summary
+        queue = JobQueue(args.db)
+        run_id = time.strftime("%Y%m%d-%H%M%S")
+        plan = plan_schedule(entries)
+        queue.submit(run_id, plan)
+        started = time.time()
+        print(f"[INFO] Run {run_id}: {len(entries)} entries in {len(plan)} jobs. Start capture nodes with:\n"
+              f"  python {Path(sys.argv[0]).name} worker --db {args.db} --run {run_id}")
+        logging.info(f"Coordinator queued run {run_id}: {len(plan)} jobs in {args.db}")
+
+        progress = None
+        try:
+            while True:
+                queue.expire_leases(run_id)
+                counts = queue.counts(run_id)
+                if counts != progress:
+                    progress = counts
+                    print(f"[INFO] Jobs: {counts.get('done', 0)} done, {counts.get('leased', 0)} capturing, "
+                          f"{counts.get('pending', 0)} pending, {counts.get('failed', 0)} failed")
+                if not counts.get("pending") and not counts.get("leased"):
+                    break
+                await asyncio.sleep(JOB_POLL_S)
+            summary = await collect_run(queue, run_id, entries, decide, started)
+        finally:
+            queue.close()
+            image_stage.shutdown()
+    summary["run_id"] = run_id
+    return report_summary(summary, args)
+
+
+async def run_worker(args):
+    """Capture node: claim jobs from the queue until the run has none left."""
+    queue = JobQueue(args.db)
+    worker = args.id or f"{socket.gethostname()}-{os.getpid()}"
+    run_id = args.run or queue.latest_run()
+    if run_id is None:
+        print("[INFO] No queued jobs.")
+        queue.close()
+        return EXIT_OK
+    TEMP_SCREENSHOT_DIR.mkdir(exist_ok=True)
+    print(f"[INFO] Worker {worker} capturing run {run_id}")
+    jobs = failed = 0
+    async with async_playwright() as p:
+        browser, context = await open_capture_context(p, not args.headed, args.viewport, "node")
+        page = context.pages[0] if context.pages else await context.new_page()
+        server_slots = asyncio.Semaphore(MAX_CONCURRENT_CAPTURES)
+        try:
+            while True:
+                job = queue.claim(run_id, worker)
+                if job is None:
+                    counts = queue.counts(run_id)
+                    if not counts.get("pending") and not counts.get("leased"):
+                        break
+                    await asyncio.sleep(JOB_POLL_S)  # leased elsewhere; picked up again if that node dies
+                    continue
+                job_id, steps = job
+                lease = asyncio.create_task(keep_lease(queue, job_id, worker))
+                try:
+                    await capture_job(queue, run_id, worker, page, steps, server_slots)
+                    queue.complete(job_id, worker)
+                    jobs += 1
+                except LoginRequired:
+                    # Every further claim would fail the same way and use up the jobs' attempts
+                    print(f"[ERROR] Worker {worker} has no valid session. Run the login command on this node "
+                          f"and start the worker again; job {job_id} goes back to the queue.")
+                    logging.error(f"Worker {worker} stopped: login required, job {job_id} released")
+                    queue.release(job_id, worker)
+                    failed += 1
+                    break
+                except Exception as e:
+                    print(f"[ERROR] Job {job_id} failed: {e}")
+                    logging.error(f"Job {job_id} failed on {worker}: {e}")
+                    queue.fail(job_id, worker, str(e))
+                    failed += 1
+                finally:
+                    lease.cancel()
+        finally:
+            await context.close()
+            if browser:
+                await browser.close()
+            queue.close()
+            image_stage.shutdown()
+    print(f"[INFO] Worker {worker} finished: {jobs} jobs captured, {failed} failed")
+    return EXIT_FAILURES if failed else EXIT_OK
+
+
+async def run_profile(args):
+    """Clone or reset Chromium profiles from the command line."""
+    if args.action == "clone":
+        names = [args.name] if args.name else [f"worker-{i}" for i in range(1, max(1, args.workers) + 1)]
+        for name in names:
+            print(f"[INFO] Cloned {profile_manager.golden} -> {profile_manager.clone(name)}")
+    else:
+        target = profile_manager.path(args.name) if args.name else profile_manager.golden
+        removed = profile_manager.reset(target, args.mode)
+        print(f"[INFO] Reset {args.mode} of {target} ({removed} entries removed)")
+    return EXIT_OK
+
+
+async def run_login(args):
+    """Log in once in a visible browser and export the session for headless runs."""
+    async with async_playwright() as p:
+        context = await p.chromium.launch_persistent_context(
+            user_data_dir=str(USERDATA_DIR),
+            headless=False,
+            viewport=None,
+            args=["--start-maximized"]
+        )
+        page = context.pages[0] if context.pages else await context.new_page()
+        try:
+            logged_in = await session_manager.ensure(page, interactive=True)
+            if logged_in:
+                await session_manager.export(context)
+        finally:
+            await context.close()
+    if not logged_in:
+        return EXIT_FAILURES
+    print(f"[INFO] Session saved to {SESSION_STATE_FILE}")
+    return EXIT_OK
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        args = build_arg_parser().parse_args()
+        sys.exit(asyncio.run(args.run(args)))
     asyncio.run(main())